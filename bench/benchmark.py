@@ -0,0 +1,160 @@
+#!python
+
+# Benchmark harness for the scripts of this repository
+#
+# For every scale (clusters x volumes x snapshots), a fleet of simulated
+# clusters is started with mock_ontap.py, and each script is run against it
+# with a generated configuration file. Wall time, API calls received by the
+# simulated clusters and peak memory (max RSS) of each run are reported.
+
+import argparse
+import json
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import mock_ontap
+
+version = "1.0.0"
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+extend_script = os.path.join(root, "ontap-extend-snaplock-expiry.py")
+delta_script = os.path.join(root, "ontap-sum-snapshot-delta.py")
+
+# Arguments Parsing
+parser = argparse.ArgumentParser(description='Benchmark the scripts against simulated ONTAP clusters')
+parser.add_argument('--version', '-v', action='version', version='%(prog)s ' + str(version))
+parser.add_argument('--config', dest="config", action='store', default=os.path.join(root, "config.json"), help="Configuration file to read labels-policies from. Defaults to the config.json of the repository")
+parser.add_argument('--scales', dest="scales", action='store', default="1x10x30,2x20x100,4x50x200", help="Comma separated list of CLUSTERSxVOLUMESxSNAPSHOTS to run. Defaults to 1x10x30,2x20x100,4x50x200")
+parser.add_argument('--runs', dest="runs", action='store', default="extend-check,extend-simulate,delta", help="Comma separated list of runs among extend-check, extend-simulate, delta and delta-pipeline. Defaults to extend-check,extend-simulate,delta")
+parser.add_argument('--repeat', '-r', dest="repeat", default=1, type=int, help="Number of times each run is repeated, the fastest is reported. Defaults to 1")
+parser.add_argument('--extend-args', dest="extend_args", action='store', default="", help="Additional arguments of ontap-extend-snaplock-expiry.py (ie. \"--cluster-query\")")
+parser.add_argument('--delta-args', dest="delta_args", action='store', default="", help="Additional arguments of ontap-sum-snapshot-delta.py (ie. \"--workers 16\")")
+parser.add_argument('--compliant-ratio', dest="compliant_ratio", default=0.9, type=float, help="Ratio of snapshots already compliant. Defaults to 0.9")
+parser.add_argument('--latency', dest="latency", default=0, type=float, help="Latency added to each API call in milliseconds. Defaults to 0")
+parser.add_argument('--error-rate', dest="error_rate", default=0, type=float, help="Ratio of API calls failing with HTTP 503. Defaults to 0")
+parser.add_argument('--timeout', dest="timeout", default=None, type=float, help="Kill runs that take longer than this number of seconds, and report them as failed (ie. to catch hangs with --error-rate)")
+parser.add_argument('--json', dest="json", action='store', default=None, help="Also write results as JSON to this file, with API calls per type")
+
+args = parser.parse_args()
+
+# Helper method to print to STDERR
+def eprint(s):
+    sys.stderr.write(str(s)+"\n")
+
+# Parse a scale like 2x50x100
+def parse_scale(scale):
+    try:
+        clusters, volumes, snapshots = [int(n) for n in scale.lower().split("x")]
+    except ValueError:
+        parser.error("Invalid scale %s, expected CLUSTERSxVOLUMESxSNAPSHOTS" % scale)
+    return clusters, volumes, snapshots
+
+# Returns the command line of a run
+def command(run, config):
+    if run == "extend-check":
+        return [sys.executable, extend_script, "--config", config, "-k", "-c"] + shlex.split(args.extend_args)
+    if run == "extend-simulate":
+        return [sys.executable, extend_script, "--config", config, "-k", "-s"] + shlex.split(args.extend_args)
+    if run == "delta":
+        return [sys.executable, delta_script, "--config", config, "-k", "--no-cache"] + shlex.split(args.delta_args)
+    if run == "delta-pipeline":
+        return [sys.executable, delta_script, "--config", config, "-k", "--no-cache", "--pipeline"] + shlex.split(args.delta_args)
+    parser.error("Unknown run %s" % run)
+
+# Returns the number of API calls received by the clusters, per type
+def count_calls(servers):
+    calls = {}
+    for server in servers:
+        with server.cluster.lock:
+            for call, count in server.cluster.calls.items():
+                calls[call] = calls.get(call, 0) + count
+    return calls
+
+# Run a command and wait for it, killing it after --timeout seconds
+# Returns the exit code, wall time in seconds, max RSS in kilobytes and
+# whether the command timed out
+def measure(cmd, workdir):
+    with open(os.path.join(workdir, "stdout"), 'w') as stdout, open(os.path.join(workdir, "stderr"), 'w') as stderr:
+        start = time.time()
+        process = subprocess.Popen(cmd, stdout=stdout, stderr=stderr, cwd=workdir)
+        timer = None
+        if args.timeout:
+            timer = threading.Timer(args.timeout, process.kill)
+            timer.start()
+        # os.wait4 gives the resource usage of this process only
+        pid, status, rusage = os.wait4(process.pid, 0)
+        wall = time.time() - start
+        timed_out = timer is not None and wall >= args.timeout
+        if timer is not None:
+            timer.cancel()
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return process.returncode, wall, rusage.ru_maxrss, timed_out
+
+with open(args.config, 'r') as configfile:
+    policies = json.load(configfile)["labels-policies"]
+
+runs = args.runs.split(",")
+for run in runs:
+    command(run, "")
+
+results = []
+any_failed = False
+print("\t".join(["Scale", "Run", "Wall(s)", "Calls", "MaxRSS(MB)", "Exit"]))
+for scale in args.scales.split(","):
+    clusters, volumes, snapshots = parse_scale(scale)
+
+    # Clusters listen on random ports
+    options = mock_ontap.parser().parse_args(["--port", "0", "--clusters", str(clusters), "--volumes", str(volumes),
+                                              "--snapshots", str(snapshots), "--compliant-ratio", str(args.compliant_ratio),
+                                              "--latency", str(args.latency), "--error-rate", str(args.error_rate)])
+    servers = mock_ontap.start(options, policies)
+
+    workdir = tempfile.mkdtemp(prefix="ontap-benchmark")
+    config = os.path.join(workdir, "config.json")
+    with open(config, 'w') as configfile:
+        json.dump({
+            "systems": [{"ip": "127.0.0.1:%i" % server.server_address[1], "username": "admin", "password-base64": "YWRtaW4="} for server in servers],
+            "labels-policies": policies,
+        }, configfile)
+
+    # Output of the runs is kept in workdir if any of them fails
+    failed = False
+    try:
+        for run in runs:
+            best = None
+            for i in range(args.repeat):
+                before = count_calls(servers)
+                code, wall, maxrss, timed_out = measure(command(run, config), workdir)
+                after = count_calls(servers)
+                calls = dict((call, after[call] - before.get(call, 0)) for call in after if after[call] != before.get(call, 0))
+                if timed_out:
+                    failed = True
+                    eprint("%s timed out after %.0fs at scale %s, see %s" % (run, args.timeout, scale, os.path.join(workdir, "stderr")))
+                elif code != 0:
+                    failed = True
+                    eprint("%s failed at scale %s (exit code %i), see %s" % (run, scale, code, os.path.join(workdir, "stderr")))
+                if best is None or wall < best["wall"]:
+                    best = {"scale": scale, "run": run, "wall": wall, "calls": calls, "maxrss": maxrss, "exit": code}
+            results.append(best)
+            print("%s\t%s\t%.3f\t%i\t%.1f\t%i" % (scale, run, best["wall"], sum(best["calls"].values()), best["maxrss"] / 1024.0, best["exit"]))
+            sys.stdout.flush()
+    finally:
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+    if failed:
+        any_failed = True
+    else:
+        shutil.rmtree(workdir)
+
+if args.json:
+    with open(args.json, 'w') as jsonfile:
+        json.dump(results, jsonfile, indent=2)
+
+sys.exit(any_failed and 1 or 0)
@@ -0,0 +1,79 @@
+#!python
+
+# Cold start budget of the scripts of this repository
+#
+# --version and --help of each script are run several times in new Python
+# processes, and the median wall time is compared to the budget. Modules
+# loaded by each command are listed with python -X importtime, to check that
+# connections and XML parsing are only imported when systems are contacted.
+# Exits with 1 if any command is over budget or imports a heavy module.
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+version = "1.0.0"
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+scripts = [os.path.join(root, "ontap-extend-snaplock-expiry.py"), os.path.join(root, "ontap-sum-snapshot-delta.py")]
+
+# Modules that must not be imported to answer --version or --help
+heavy_modules = ["requests", "urllib3", "xml.etree", "sqlite3", "http.server", "concurrent.futures"]
+
+# Arguments Parsing
+parser = argparse.ArgumentParser(description='Measure the cold start time of the scripts')
+parser.add_argument('--version', '-v', action='version', version='%(prog)s ' + str(version))
+parser.add_argument('--repeat', '-r', dest="repeat", default=10, type=int, help="Number of times each command is run, the median is reported. Defaults to 10")
+parser.add_argument('--budget', dest="budget", default=100, type=float, help="Maximum median wall time of each command in milliseconds. Defaults to 100")
+parser.add_argument('--commands', dest="commands", action='store', default="--version,--help", help="Comma separated list of arguments to run each script with. Defaults to --version,--help")
+
+args = parser.parse_args()
+
+# Returns the median of a list
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+# Returns the wall time of a command in milliseconds
+def measure(cmd):
+    start = time.time()
+    subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, cwd=root, check=True)
+    return (time.time() - start) * 1000
+
+# Returns the heavy modules imported by a command
+def heavy_imports(cmd):
+    result = subprocess.run([cmd[0], "-X", "importtime"] + cmd[1:], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, cwd=root, check=True, universal_newlines=True)
+    found = set()
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        module = line.rsplit("|", 1)[1].strip()
+        for heavy in heavy_modules:
+            if module == heavy or module.startswith(heavy + "."):
+                found.add(heavy)
+    return sorted(found)
+
+# Reference time of the interpreter alone
+baseline = median([measure([sys.executable, "-c", "pass"]) for i in range(args.repeat)])
+
+over = False
+print("\t".join(["Command", "Median(ms)", "Heavy imports", "Status"]))
+print("%s\t%.1f\t\t" % ("python -c pass", baseline))
+for script in scripts:
+    for command in args.commands.split(","):
+        cmd = [sys.executable, script, command]
+        elapsed = median([measure(cmd) for i in range(args.repeat)])
+        imports = heavy_imports(cmd)
+        status = "ok"
+        if elapsed > args.budget or imports:
+            status = "over budget"
+            over = True
+        print("%s %s\t%.1f\t%s\t%s" % (os.path.basename(script), command, elapsed, ",".join(imports), status))
+
+sys.exit(over and 1 or 0)
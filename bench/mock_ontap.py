@@ -0,0 +1,391 @@
+#!python
+
+# Local ONTAP simulator used by the benchmark harness.
+#
+# Implements the subset of the ONTAP REST API and ONTAPI (XML) used by
+# ontap-extend-snaplock-expiry.py and ontap-sum-snapshot-delta.py, on top of a
+# synthetic fleet of clusters x volumes x snapshots. Every cluster listens on
+# its own HTTPS port on 127.0.0.1 and can be used as an "ip" in config.json
+# (ie. "127.0.0.1:8443").
+
+import argparse
+import datetime
+import hashlib
+import json
+import logging
+import random
+import re
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import os
+import xml.etree.ElementTree as ET
+
+try:
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import urlsplit, parse_qs, urlencode
+except ImportError:
+    sys.exit("mock_ontap.py requires Python 3.7 or later")
+
+NS = "http://www.netapp.com/filer/admin"
+ONTAPI_URL = "/servlets/netapp.servlets.admin.XMLrequest_filer"
+TZ = datetime.timezone(datetime.timedelta(hours=2))
+
+# Format a date like ONTAP does (ie. 2024-01-01T00:00:00+02:00)
+def ontap_time(d):
+    return d.astimezone(TZ).strftime('%Y-%m-%dT%H:%M:%S%z')[:-2] + ":" + d.astimezone(TZ).strftime('%z')[-2:]
+
+# Parse a date sent by the scripts, with or without time zone
+def parse_time(s):
+    s = s.strip()
+    m = re.match(r'^(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2})([+-]\d{2}):?(\d{2})$', s)
+    if m:
+        return datetime.datetime.strptime(m.group(1) + m.group(2) + m.group(3), '%Y-%m-%dT%H:%M:%S%z')
+    if s.endswith("Z"):
+        return datetime.datetime.strptime(s[:-1], '%Y-%m-%dT%H:%M:%S').replace(tzinfo=datetime.timezone.utc)
+    # Naive dates are interpreted in the cluster time zone
+    return datetime.datetime.strptime(s, '%Y-%m-%dT%H:%M:%S').replace(tzinfo=TZ)
+
+# Synthetic cluster with SnapLock volumes and labeled snapshots
+#
+# compliant_ratio of the snapshots have an expiry time matching the policy of
+# their label, the others expire a minute after their creation.
+class Cluster(object):
+
+    def __init__(self, index, volumes, snapshots, policies, compliant_ratio, seed):
+        self.name = "cluster%d" % index
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.volumes = []
+        self.snapshots = {}
+        rnd = random.Random(seed + index)
+        now = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+        labels = list(policies.keys())
+        for v in range(volumes):
+            vol = {"uuid": "%08x-0000-0000-0000-%012x" % (index, v), "name": "vol%d" % v,
+                   "svm": "svm%d" % (v % 4)}
+            self.volumes.append(vol)
+            snaps = []
+            for s in range(snapshots):
+                label = labels[s % len(labels)]
+                # Same schedule on every volume so snapshot names and create
+                # times line up across volumes, as they do on real systems
+                create = now - datetime.timedelta(seconds=3600 * (snapshots - s))
+                if rnd.random() < compliant_ratio:
+                    expiry = create + datetime.timedelta(seconds=policies[label])
+                else:
+                    expiry = create + datetime.timedelta(seconds=60)
+                snaps.append({
+                    "uuid": "%08x-%04x-0000-0000-%012x" % (index, v, s),
+                    "name": "%s.%s" % (label, create.strftime('%Y-%m-%d_%H%M')),
+                    "create_time": create,
+                    "snaplock_expiry_time": expiry,
+                    "snapmirror_label": label,
+                    "svm": vol["svm"],
+                    "volume": vol,
+                })
+            self.snapshots[vol["uuid"]] = snaps
+
+    # Count an API call, returned by GET /mock/calls
+    def count(self, call):
+        with self.lock:
+            self.calls[call] = self.calls.get(call, 0) + 1
+
+    # Returns the REST record of a snapshot with the requested fields, or all
+    # fields if fields is None
+    def snapshot_record(self, s, fields):
+        record = {"uuid": s["uuid"], "name": s["name"]}
+        full = fields is None
+        fields = fields or []
+        if full or "create_time" in fields or "*" in fields:
+            record["create_time"] = ontap_time(s["create_time"])
+        if full or "snaplock_expiry_time" in fields or "*" in fields:
+            record["snaplock_expiry_time"] = ontap_time(s["snaplock_expiry_time"])
+        if full or "snapmirror_label" in fields or "*" in fields:
+            record["snapmirror_label"] = s["snapmirror_label"]
+        if full or "svm" in fields or "svm.name" in fields or "*" in fields:
+            record["svm"] = {"name": s["svm"]}
+        if full or "volume" in fields or "volume.name" in fields or "volume.uuid" in fields or "*" in fields:
+            record["volume"] = {"name": s["volume"]["name"], "uuid": s["volume"]["uuid"]}
+        return record
+
+# REST and ONTAPI requests of a cluster
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        logging.debug(format, *args)
+
+    @property
+    def cluster(self):
+        return self.server.cluster
+
+    @property
+    def options(self):
+        return self.server.options
+
+    def reply(self, code, body, content_type="application/json"):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # Count the call, wait for the configured latency and fail randomly with
+    # the configured error rate
+    # Returns False if an error was sent
+    def simulate(self, call):
+        self.cluster.count(call)
+        if self.options.latency:
+            time.sleep(self.options.latency / 1000.0)
+        if self.options.error_rate and random.random() < self.options.error_rate:
+            self.reply(503, {"error": {"message": "Simulated error", "code": "503"}})
+            return False
+        return True
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        query = dict((k, v[-1]) for k, v in parse_qs(parts.query).items())
+        path = parts.path.rstrip("/")
+
+        if path == "/mock/calls":
+            with self.cluster.lock:
+                return self.reply(200, dict(self.cluster.calls))
+
+        if path == "/api/storage/volumes":
+            if not self.simulate("volumes"):
+                return
+            records = [{"uuid": v["uuid"], "name": v["name"]} for v in self.cluster.volumes]
+            return self.reply(200, {"records": records, "num_records": len(records)})
+
+        m = re.match(r"^/api/storage/volumes/([^/]+)/snapshots(?:/([^/]+))?$", path)
+        if m and m.group(2):
+            if not self.simulate("snapshot"):
+                return
+            for s in self.cluster.snapshots.get(m.group(1), []):
+                if s["uuid"] == m.group(2):
+                    return self.reply(200, self.cluster.snapshot_record(s, None))
+            return self.reply(404, {"error": {"message": "entry doesn't exist", "code": "4"}})
+        if m:
+            if not self.simulate("snapshots"):
+                return
+            return self.list_snapshots(m.group(1), query)
+
+        self.reply(404, {"error": {"message": "Not found", "code": "3"}})
+
+    # GET /api/storage/volumes/{uuid}/snapshots, with queries on labels, names,
+    # uuids and create_time, order_by and pagination with max_records
+    def list_snapshots(self, volume_uuid, query):
+        if volume_uuid == "*":
+            if not self.options.wildcard:
+                return self.reply(400, {"error": {"message": "Invalid volume UUID", "code": "2"}})
+            snaps = [s for v in self.cluster.volumes for s in self.cluster.snapshots[v["uuid"]]]
+        elif volume_uuid in self.cluster.snapshots:
+            snaps = self.cluster.snapshots[volume_uuid]
+        else:
+            return self.reply(404, {"error": {"message": "Volume not found", "code": "4"}})
+
+        fields = None
+        if "fields" in query:
+            fields = query["fields"].split(",")
+            if not self.options.fields and set(fields) - set(["uuid", "name"]):
+                return self.reply(400, {"error": {"message": "Unexpected argument \"fields\"", "code": "262179"}})
+        else:
+            fields = []
+
+        for key in ("snapmirror_label", "name", "uuid", "volume.uuid", "volume.name", "svm.name"):
+            if key in query:
+                values = set(query[key].split("|"))
+                def get(s, key=key):
+                    if key == "volume.uuid":
+                        return s["volume"]["uuid"]
+                    if key == "volume.name":
+                        return s["volume"]["name"]
+                    if key == "svm.name":
+                        return s["svm"]
+                    return s[key]
+                snaps = [s for s in snaps if get(s) in values]
+        if "create_time" in query:
+            m = re.match(r"^(>=|<=|>|<)?(.*)$", query["create_time"])
+            op, value = m.group(1) or "", parse_time(m.group(2))
+            ops = {">=": lambda a: a >= value, "<=": lambda a: a <= value,
+                   ">": lambda a: a > value, "<": lambda a: a < value, "": lambda a: a == value}
+            snaps = [s for s in snaps if ops[op](s["create_time"])]
+        if "order_by" in query:
+            key, _, direction = query["order_by"].partition(" ")
+            snaps = sorted(snaps, key=lambda s: s[key], reverse=(direction == "desc"))
+
+        start = int(query.get("start", "0"))
+        max_records = int(query.get("max_records", "0")) or len(snaps)
+        page = snaps[start:start + max_records]
+        body = {"records": [self.cluster.snapshot_record(s, fields) for s in page], "num_records": len(page)}
+        if start + max_records < len(snaps):
+            q = dict(query)
+            q["start"] = str(start + max_records)
+            body["_links"] = {"next": {"href": "/api/storage/volumes/%s/snapshots?%s" % (volume_uuid, urlencode(q))}}
+        self.reply(200, body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", "0"))
+        payload = self.rfile.read(length)
+        path = urlsplit(self.path).path
+
+        if path == "/api/private/cli/snapshot/modify-snaplock-expiry-time":
+            if not self.simulate("modify"):
+                return
+            return self.modify_expiry(json.loads(payload.decode("utf-8")))
+        if path == ONTAPI_URL:
+            return self.ontapi(payload)
+        self.reply(404, {"error": {"message": "Not found", "code": "3"}})
+
+    # modify-snaplock-expiry-time, with queries on volume and snapshot names
+    # Expiry times can only be extended, like on SnapLock volumes
+    def modify_expiry(self, data):
+        try:
+            expiry = parse_time(data["expiry-time"])
+        except (KeyError, ValueError):
+            return self.reply(400, {"error": {"message": "Invalid expiry-time", "code": "2"}})
+        volumes = set(data.get("volume", "").split("|"))
+        names = set(data.get("snapshot", "").split("|"))
+        matched = []
+        for vol in self.cluster.volumes:
+            if vol["name"] not in volumes or vol["svm"] != data.get("vserver"):
+                continue
+            for s in self.cluster.snapshots[vol["uuid"]]:
+                if s["name"] in names:
+                    matched.append(s)
+        if not matched:
+            return self.reply(400, {"error": {"message": "There are no entries matching your query.", "code": "1"}})
+        for s in matched:
+            if expiry < s["snaplock_expiry_time"]:
+                return self.reply(400, {"error": {"message": "Cannot shorten the SnapLock expiry time", "code": "13001"}})
+        for s in matched:
+            s["snaplock_expiry_time"] = expiry
+        self.reply(200, {"num_records": len(matched)})
+
+    def ontapi(self, payload):
+        root = ET.fromstring(payload)
+        request = root[0]
+        tag = request.tag.replace("{%s}" % NS, "")
+        if not self.simulate(tag):
+            return
+        if tag == "snapshot-get-iter":
+            return self.snapshot_get_iter(request)
+        if tag == "snapshot-delta-info":
+            return self.snapshot_delta_info(root, request)
+        self.reply(200, self.ontapi_body('<results status="failed" reason="Unsupported API" errno="13005"/>'), "text/xml")
+
+    def ontapi_body(self, results):
+        return ("<?xml version='1.0' encoding='UTF-8' ?>\n"
+                "<!DOCTYPE netapp SYSTEM 'file:/etc/netapp_gx.dtd'>\n"
+                "<netapp version='1.170' xmlns='%s'>\n%s</netapp>\n" % (NS, results)).encode("utf-8")
+
+    # snapshot-get-iter, paginated with max-records and next-tag
+    def snapshot_get_iter(self, request):
+        def text(path):
+            e = request.find(path)
+            return e.text if e is not None and e.text else ""
+        labels = set(text("{%s}query/{%s}snapshot-info/{%s}snapmirror-label" % (NS, NS, NS)).split("|"))
+        wanted = [e.tag.replace("{%s}" % NS, "") for e in
+                  request.findall("{%s}desired-attributes/{%s}snapshot-info/*" % (NS, NS))]
+        max_records = int(text("{%s}max-records" % NS) or "20")
+        start = int(text("{%s}tag" % NS).replace("&lt;", "<").replace("&gt;", ">").strip("<>") or "0")
+
+        snaps = [s for v in sorted(self.cluster.volumes, key=lambda v: (v["svm"], v["name"]))
+                 for s in self.cluster.snapshots[v["uuid"]] if s["snapmirror_label"] in labels]
+        page = snaps[start:start + max_records]
+        out = ['<results status="passed"><attributes-list>']
+        for s in page:
+            out.append("<snapshot-info>")
+            values = {
+                "name": s["name"],
+                "volume": s["volume"]["name"],
+                "vserver": s["svm"],
+                "volume-provenance-uuid": s["volume"]["uuid"],
+                "snapshot-instance-uuid": s["uuid"],
+                "snapmirror-label": s["snapmirror_label"],
+                "access-time": str(int(s["create_time"].timestamp())),
+            }
+            for w in wanted:
+                if w in values:
+                    out.append("<%s>%s</%s>" % (w, values[w], w))
+            out.append("</snapshot-info>")
+        out.append("</attributes-list>")
+        if start + max_records < len(snaps):
+            out.append("<next-tag>&lt;%d&gt;</next-tag>" % (start + max_records))
+        out.append("<num-records>%d</num-records></results>" % len(page))
+        self.reply(200, self.ontapi_body("".join(out)), "text/xml")
+
+    # snapshot-delta-info, with a size derived from the snapshot names so it
+    # is the same on every run
+    def snapshot_delta_info(self, root, request):
+        names = [request.find("{%s}%s" % (NS, k)).text for k in ("snapshot1", "snapshot2", "volume")]
+        size = int(hashlib.md5("|".join(names + [root.get("vfiler", "")]).encode("utf-8")).hexdigest()[:6], 16) * 4096
+        self.reply(200, self.ontapi_body(
+            '<results status="passed"><consumed-size>%d</consumed-size><elapsed-time>3600</elapsed-time></results>' % size),
+            "text/xml")
+
+# Returns the paths of a temporary self-signed certificate and its key
+def self_signed_certificate():
+    directory = tempfile.mkdtemp(prefix="mock_ontap")
+    cert = os.path.join(directory, "cert.pem")
+    key = os.path.join(directory, "key.pem")
+    subprocess.check_call(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-keyout", key,
+                           "-out", cert, "-days", "1", "-subj", "/CN=localhost"],
+                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return cert, key
+
+# Start one server per cluster, in background threads
+# Clusters listen on consecutive ports from options.port, or on random ports
+# if options.port is 0
+# Returns the list of servers
+def start(options, policies):
+    cert, key = self_signed_certificate()
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key)
+    servers = []
+    for i in range(options.clusters):
+        server = ThreadingHTTPServer(("127.0.0.1", options.port + i if options.port else 0), Handler)
+        server.daemon_threads = True
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+        server.cluster = Cluster(i, options.volumes, options.snapshots, policies, options.compliant_ratio, options.seed)
+        server.options = options
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+    return servers
+
+def parser():
+    parser = argparse.ArgumentParser(description='Local ONTAP REST/ONTAPI simulator')
+    parser.add_argument('--config', dest="config", action='store', default="config.json", help="Configuration file to read labels-policies from. Defaults to ./config.json")
+    parser.add_argument('--port', dest="port", default=8443, type=int, help="First port to listen on, one port per cluster. Defaults to 8443")
+    parser.add_argument('--clusters', dest="clusters", default=1, type=int, help="Number of clusters. Defaults to 1")
+    parser.add_argument('--volumes', dest="volumes", default=10, type=int, help="Number of SnapLock volumes per cluster. Defaults to 10")
+    parser.add_argument('--snapshots', dest="snapshots", default=30, type=int, help="Number of snapshots per volume. Defaults to 30")
+    parser.add_argument('--compliant-ratio', dest="compliant_ratio", default=0.9, type=float, help="Ratio of snapshots already compliant. Defaults to 0.9")
+    parser.add_argument('--latency', dest="latency", default=0, type=float, help="Latency added to each API call in milliseconds. Defaults to 0")
+    parser.add_argument('--error-rate', dest="error_rate", default=0, type=float, help="Ratio of API calls failing with HTTP 503. Defaults to 0")
+    parser.add_argument('--no-fields', dest="fields", action="store_false", default=True, help="Reject fields= in snapshot list calls, like older ONTAP releases")
+    parser.add_argument('--no-wildcard', dest="wildcard", action="store_false", default=True, help="Reject /api/storage/volumes/*/snapshots, like older ONTAP releases")
+    parser.add_argument('--seed', dest="seed", default=0, type=int, help="Random seed. Defaults to 0")
+    parser.add_argument('--debug', '-d', dest="debug", action="store_true", default=False, help="Run in debug mode")
+    return parser
+
+if __name__ == "__main__":
+    args = parser().parse_args()
+    if args.debug:
+        logging.basicConfig(level=logging.DEBUG)
+    with open(args.config, 'r') as configfile:
+        policies = json.load(configfile)["labels-policies"]
+    servers = start(args, policies)
+    for server in servers:
+        sys.stderr.write("%s listening on 127.0.0.1:%d\n" % (server.cluster.name, server.server_address[1]))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,29 @@
+# Shared code for the ONTAP SnapLock and snapshot scripts of this repository
+#
+# - cli : command line of the scripts
+# - client : connections to ONTAP systems
+# - discovery : listing of SnapLock volumes and snapshots
+# - evaluation : compliance of snapshot expiry times
+# - apply : changes of snapshot expiry times
+# - extend : checks and extension of SnapLock expiry times on systems
+# - delta : snapshot deltas per snapmirror label
+# - shard : partitioning of runs across hosts and merge of their results
+# - report : formats of the snapshot delta report
+#
+# Modules only import what they need, so importing the package or the command
+# line doesn't load requests or XML parsing.
+
+import sys
+
+# Helper method to remove password from logs
+def _protect(d):
+    e = d.copy()
+    if "password" in e:
+        e['password'] = "<REDACTED>"
+    if "key" in e:
+        e['key'] = "<REDACTED>"
+    return e
+
+# Helper method to print to STDERR
+def eprint(s):
+    sys.stderr.write(str(s)+"\n")
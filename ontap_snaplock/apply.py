@@ -0,0 +1,137 @@
+import collections
+import concurrent.futures
+import logging
+
+from ontap_snaplock import eprint, stats
+from ontap_snaplock.discovery import get_records
+from ontap_snaplock.evaluation import parse_time
+
+modify_expiry_url = '/api/private/cli/snapshot/modify-snaplock-expiry-time'
+
+# Call modify-snaplock-expiry-time
+# Returns the response on success, or None
+def modify_expiry(client, data, quiet=False):
+    try:
+        logging.debug("Calling %s with data : %s", modify_expiry_url, data)
+        u = client.post(modify_expiry_url, stats.MODIFY_EXPIRY, json=data)
+        logging.debug("Set Expiry Time Result : %s", u.text)
+        if u.status_code != 200:
+            if not quiet:
+                eprint(u.json()['error']['message'])
+            return None
+    except Exception as e:
+        logging.debug("modify-snaplock-expiry-time failed : %s", e)
+        return None
+    return u
+
+# Returns True if a batch call changed every snapshot of the batch
+# The query silently skips volumes that don't exist anymore, so the number of
+# records changed is compared to the size of the batch.
+def batch_applied(response, batch):
+    if response is None:
+        return False
+    try:
+        return response.json().get('num_records') == len(batch)
+    except ValueError:
+        return False
+
+# Report the result of a change and record it in the change
+def report_change(client, change, applied):
+    if applied:
+        change['status'] = "applied"
+        eprint("Set expiry-time from creation time %s to %s on snapshot %s for volume %s on svm %s on %s" % (change['create_time'],change['expiry-time'],change['snapshot'],change['volume'],change['vserver'],client.ip))
+    else:
+        change['status'] = "failed"
+        eprint("Failed to update expiry-time %s on snapshot %s for volume %s on svm %s on %s" % (change['expiry-time'],change['snapshot'],change['volume'],change['vserver'],client.ip))
+
+# Apply planned changes on a system
+#
+# With batch_query, changes setting the same expiry time on snapshots with the
+# same name in several volumes of a vserver (ie. snapshots taken by the same
+# schedule) are sent as a single call with a query on the volume name,
+# batch_size volumes at a time. Batches that fail are retried one snapshot at
+# a time, as well as batches that changed fewer snapshots than requested. All
+# calls are sent workers at a time.
+# With simulate, changes are only reported.
+def apply_changes(client, changes, simulate=False, batch_query=False, batch_size=50, workers=4):
+    if simulate:
+        for change in changes:
+            eprint("Would set expiry-time from creation time %s to %s on snapshot %s for volume %s on svm %s on %s" % (change['create_time'],change['expiry-time'],change['snapshot'],change['volume'],change['vserver'],client.ip))
+        return
+
+    single = []
+    batches = []
+    if batch_query:
+        groups = collections.OrderedDict()
+        for change in changes:
+            groups.setdefault((change['vserver'],change['snapshot'],change['expiry-time']),[]).append(change)
+        for group in groups.values():
+            if len(group) == 1:
+                single.extend(group)
+                continue
+            for i in range(0, len(group), batch_size):
+                batches.append(group[i:i+batch_size])
+    else:
+        single = changes
+
+    def data(batch):
+        return {'vserver':batch[0]['vserver'],'volume':"|".join(c['volume'] for c in batch),'snapshot':batch[0]['snapshot'],'expiry-time':batch[0]['expiry-time']}
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        for batch, response in zip(batches, executor.map(lambda batch: modify_expiry(client, data(batch), quiet=True), batches)):
+            if batch_applied(response, batch):
+                for change in batch:
+                    report_change(client, change, True)
+            else:
+                logging.debug("Batch update of snapshot %s on %i volumes failed on %s, retrying one volume at a time" % (batch[0]['snapshot'],len(batch),client.ip))
+                single.extend(batch)
+
+        for change, response in zip(single, executor.map(lambda change: modify_expiry(client, data([change])), single)):
+            report_change(client, change, response is not None)
+
+# Check that the changes of a plan still need to be applied, with one snapshot
+# list per volume and per 100 snapshots
+# evaluator is the Evaluator giving the maximum expiry time
+# Returns the changes to apply
+def revalidate_changes(client, changes, evaluator, max_records=1000):
+    volumes = collections.OrderedDict()
+    for change in changes:
+        volumes.setdefault(change['volume_uuid'],[]).append(change)
+
+    valid = []
+    for volume_uuid, volume_changes in volumes.items():
+        snapshots = {}
+        for i in range(0, len(volume_changes), 100):
+            uuids = "|".join(change['snapshot_uuid'] for change in volume_changes[i:i+100])
+            records, status_code = get_records(client, '/api/storage/volumes/%s/snapshots?uuid=%s&fields=create_time,snaplock_expiry_time&max_records=%i' % (volume_uuid,uuids,max_records))
+            if records is None and status_code == 400:
+                # Fields not supported, get each snapshot instead
+                records = []
+                for change in volume_changes[i:i+100]:
+                    t = client.get('/api/storage/volumes/%s/snapshots/%s' % (volume_uuid,change['snapshot_uuid']), stats.SNAPSHOT_DETAIL)
+                    if t.status_code == 200:
+                        records.append(t.json())
+            if records is None:
+                eprint("Failed to get snapshots for volume %s on %s" % (volume_uuid,client.ip))
+                records = []
+            for record in records:
+                snapshots[record['uuid']] = record
+
+        for change in volume_changes:
+            snapshot = snapshots.get(change['snapshot_uuid'])
+            if snapshot is None or snapshot.get('create_time') != change['create_time']:
+                eprint("Snapshot %s for volume %s on svm %s on %s doesn't exist anymore, skipping" % (change['snapshot'],change['volume'],change['vserver'],client.ip))
+                continue
+            # Plans written by older releases have expiry times without time
+            # zone, in the time zone of the system
+            expiry_time = parse_time(change['expiry-time'], parse_time(change['create_time']).tzinfo)
+            if snapshot.get('snaplock_expiry_time') and parse_time(snapshot['snaplock_expiry_time']) >= expiry_time:
+                eprint("Snapshot %s for volume %s on svm %s on %s already has expiry-time %s, skipping" % (change['snapshot'],change['volume'],change['vserver'],client.ip,snapshot['snaplock_expiry_time']))
+                continue
+            if evaluator.beyond_max_expiry(expiry_time):
+                logging.warning("Would set a date beyond max_expiry, ignoring")
+                continue
+            change['snaplock_expiry_time'] = snapshot.get('snaplock_expiry_time')
+            valid.append(change)
+
+    return valid
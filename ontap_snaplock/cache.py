@@ -0,0 +1,94 @@
+import logging
+import sqlite3
+import time
+
+# Persistent cache of snapshot deltas
+#
+# The content of a snapshot never changes, so the delta between two given
+# snapshots is computed once and kept in a SQLite database. Snapshots are
+# identified by their name and instance uuid, so a snapshot deleted and
+# recreated with the same name is not mistaken for the old one.
+#
+# Every entry used during a run is marked with the run time, so entries that
+# were not used (because one of the snapshots doesn't exist anymore) can be
+# evicted at the end of the run. Sharded runs only evict the entries of the
+# systems or volumes they own.
+class DeltaCache(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS deltas (
+            cluster TEXT NOT NULL,
+            vserver TEXT NOT NULL,
+            volume TEXT NOT NULL,
+            snapshot1 TEXT NOT NULL,
+            snapshot2 TEXT NOT NULL,
+            uuid1 TEXT,
+            uuid2 TEXT,
+            size INTEGER NOT NULL,
+            seen REAL NOT NULL,
+            PRIMARY KEY (cluster, vserver, volume, snapshot1, snapshot2)
+        )""")
+        self.run = time.time()
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    # Returns the cached delta between two snapshots, or None
+    def get(self, cluster, vserver, volume, snapshot1, snapshot2, uuid1=None, uuid2=None):
+        key = (cluster, vserver, volume, snapshot1, snapshot2)
+        row = self.db.execute("SELECT size, uuid1, uuid2 FROM deltas WHERE cluster=? AND vserver=? AND volume=? AND snapshot1=? AND snapshot2=?", key).fetchone()
+        if row is None or (row[1], row[2]) != (uuid1, uuid2):
+            self.misses += 1
+            return None
+        self.db.execute("UPDATE deltas SET seen=? WHERE cluster=? AND vserver=? AND volume=? AND snapshot1=? AND snapshot2=?", (self.run,) + key)
+        self.hits += 1
+        return row[0]
+
+    def put(self, cluster, vserver, volume, snapshot1, snapshot2, size, uuid1=None, uuid2=None):
+        self.db.execute("INSERT OR REPLACE INTO deltas VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (cluster, vserver, volume, snapshot1, snapshot2, uuid1, uuid2, size, self.run))
+
+    # Returns the (cluster, vserver, volume) of the entries for which
+    # owned(cluster, vserver, volume) is True, of a single cluster if given
+    def owned_volumes(self, owned, cluster=None):
+        if cluster is None:
+            volumes = self.db.execute("SELECT DISTINCT cluster, vserver, volume FROM deltas").fetchall()
+        else:
+            volumes = self.db.execute("SELECT DISTINCT cluster, vserver, volume FROM deltas WHERE cluster=?", (cluster,)).fetchall()
+        return [volume for volume in volumes if owned(*volume)]
+
+    # Remove entries of a cluster that were not used during this run
+    # If owned is given, only entries for which owned(cluster, vserver, volume)
+    # is True are removed, ie. the volumes of a shard with --shard-volumes, so
+    # shards sharing a cache don't evict the entries of each other.
+    def evict(self, cluster, owned=None):
+        if owned is None:
+            evicted = self.db.execute("DELETE FROM deltas WHERE cluster=? AND seen<?", (cluster, self.run)).rowcount
+        else:
+            evicted = 0
+            for volume in self.owned_volumes(owned, cluster):
+                evicted += self.db.execute("DELETE FROM deltas WHERE cluster=? AND vserver=? AND volume=? AND seen<?", volume + (self.run,)).rowcount
+        self.evicted += evicted
+        logging.debug("Evicted %i snapshot deltas of %s from cache" % (evicted, cluster))
+
+    # Remove all entries, or only those for which owned(cluster, vserver,
+    # volume) is True if given
+    def clear(self, owned=None):
+        if owned is None:
+            self.db.execute("DELETE FROM deltas")
+        else:
+            for volume in self.owned_volumes(owned):
+                self.db.execute("DELETE FROM deltas WHERE cluster=? AND vserver=? AND volume=?", volume)
+        self.commit()
+
+    def commit(self):
+        self.db.commit()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "evicted": self.evicted}
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
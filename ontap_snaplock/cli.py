@@ -0,0 +1,390 @@
+import argparse
+import json
+import logging
+import sys
+
+from ontap_snaplock import eprint
+
+# Command line of ontap-extend-snaplock-expiry.py and ontap-sum-snapshot-delta.py
+#
+# Only the standard modules needed to parse arguments are imported here.
+# Connections to systems (requests, urllib3) and XML parsing are imported
+# once arguments are parsed, so --version and --help answer immediately.
+
+extend_version = "1.0.0"
+delta_version = "0.9.2"
+
+# Returns the argument parser of ontap-extend-snaplock-expiry.py
+def extend_parser():
+    parser = argparse.ArgumentParser(description='Update Snaplock snapshot expiry time according to snapmirror labels')
+    parser.add_argument('--version', '-v', action='version', version='%(prog)s ' + str(extend_version))
+    parser.add_argument('--config', dest="config", action='store', default="config.json", help="Path to configuration file. Defaults to ./config.json")
+    parser.add_argument('--simulate', '-s', dest="simulate", action="store_true", default=False, help="Simulate, don't apply expiry date change and report on what would be done")
+    parser.add_argument('--plan', dest="plan", action='store', default=None, help="With --simulate, write the expiry date changes that would be done to this file, one JSON object per line")
+    parser.add_argument('--apply-plan', dest="apply_plan", action='store', default=None, help="Apply the expiry date changes of a plan written with --plan, without listing snapshots again")
+    parser.add_argument('--check', '-c', dest="check", action="store_true", default=False, help="Check current Snaplock expiry and return compliant/non-compliant/error for each system")
+    parser.add_argument('--max-expiry', '-m', dest="max_expiry", default=15768000, type=int, help="Maximum expiration time that can be set in seconds. Defaults to 15768000 (6 months)")
+    parser.add_argument('--max-records', dest="max_records", default=1000, type=int, help="Number of records retrieved per API call. Defaults to 1000")
+    parser.add_argument('--cluster-query', dest="cluster_query", action="store_true", default=False, help="List snapshots of all volumes with a single query per system instead of one query per volume and label")
+    parser.add_argument('--state', dest="state", action='store', default=None, help="Path to the state index of snapshots already confirmed compliant. Only snapshots created since the last run are evaluated when set")
+    parser.add_argument('--full', dest="full", action="store_true", default=False, help="Ignore the state index and evaluate all snapshots")
+    parser.add_argument('--apply-workers', dest="apply_workers", default=4, type=int, help="Number of expiry time changes applied in parallel on a single system. Defaults to 4")
+    parser.add_argument('--batch-query', dest="batch_query", action="store_true", default=False, help="Change the expiry time of snapshots with the same name and expiry time in several volumes with a single query")
+    parser.add_argument('--batch-size', dest="batch_size", default=50, type=int, help="Maximum number of volumes changed by a single query with --batch-query. Defaults to 50")
+    parser.add_argument('--workers', '-w', dest="workers", default=4, type=int, help="Number of systems processed in parallel. Defaults to 4")
+    parser.add_argument('--cluster-concurrency', dest="cluster_concurrency", default=2, type=int, help="Number of volumes processed in parallel on a single system. Defaults to 2")
+    parser.add_argument('--timeout', dest="timeout", default=30, type=float, help="Timeout of API calls in seconds. Defaults to 30")
+    parser.add_argument('--retries', dest="retries", default=3, type=int, help="Number of retries of failed API calls, with exponential backoff. Defaults to 3")
+    parser.add_argument('--pool-size', dest="pool_size", default=10, type=int, help="Maximum number of connections kept open to each system. Defaults to 10")
+    parser.add_argument('--exporter', dest="exporter", action='store', default=None, metavar="[ADDRESS:]PORT", help="Run continuously and expose SnapLock compliance as Prometheus metrics on http://ADDRESS:PORT/metrics. ADDRESS defaults to all interfaces")
+    parser.add_argument('--interval', dest="interval", default=300, type=float, help="With --exporter, seconds between two scans of a system. Defaults to 300")
+    parser.add_argument('--jitter', dest="jitter", default=30, type=float, help="With --exporter, maximum random delay in seconds added to --interval, so systems are not all scanned at the same time. Defaults to 30")
+    parser.add_argument('--shard', dest="shard", action='store', default=None, metavar="SHARD/COUNT", help="Only process the systems owned by shard SHARD of COUNT (ie. 1/4), to split a run across several hosts or processes")
+    parser.add_argument('--shard-volumes', dest="shard_volumes", action="store_true", default=False, help="With --shard, process all systems but only the volumes owned by the shard")
+    parser.add_argument('--partial', dest="partial", action='store', default=None, help="Write the results of the run to this file, to be combined with the results of other shards with --merge")
+    parser.add_argument('--merge', dest="merge", action='store', nargs='+', default=None, metavar="PARTIAL", help="Print the report of a sharded run from the files written by each shard with --partial, without contacting systems")
+    parser.add_argument('--stats', dest="stats", nargs='?', const='-', default=None, help="Print timings of API calls per system on stderr, or write them as JSON to STATS")
+    parser.add_argument('-k', dest="ignore_ssl", action="store_true", default=False, help="Ignore SSL errors")
+    parser.add_argument('--debug', '-d', dest="debug", action="store_true", default=False, help="Run in debug mode")
+    return parser
+
+# Returns the argument parser of ontap-sum-snapshot-delta.py
+def delta_parser():
+    parser = argparse.ArgumentParser(description='Get snapshot deltas for a given label')
+    parser.add_argument('--version', '-v', action='version', version='%(prog)s ' + str(delta_version))
+    parser.add_argument('--config', dest="config", action='store', default="config.json", help="Path to configuration file. Defaults to ./config.json")
+    parser.add_argument('--workers', '-w', dest="workers", default=8, type=int, help="Number of snapshot deltas retrieved in parallel. Defaults to 8")
+    parser.add_argument('--max-records', dest="max_records", default=500, type=int, help="Number of snapshots retrieved per API call. Defaults to 500")
+    parser.add_argument('--cache', dest="cache", action='store', default="snapshot-delta-cache.db", help="Path to the snapshot delta cache. Defaults to ./snapshot-delta-cache.db")
+    parser.add_argument('--no-cache', dest="no_cache", action="store_true", default=False, help="Don't use the snapshot delta cache")
+    parser.add_argument('--rebuild-cache', dest="rebuild_cache", action="store_true", default=False, help="Empty the snapshot delta cache before running")
+    parser.add_argument('--pipeline', dest="pipeline", action="store_true", default=False, help="List, parse and sum snapshot deltas as separate stages, parsing on several processes, and print each row as soon as it is complete")
+    parser.add_argument('--parsers', dest="parsers", default=2, type=int, help="With --pipeline, number of processes parsing snapshot lists. Defaults to 2")
+    parser.add_argument('--format', dest="format", action='store', default="tsv", choices=["tsv","csv","jsonl"], help="Format of the report : tsv (a header per system), csv or jsonl. Defaults to tsv")
+    parser.add_argument('--timeout', dest="timeout", default=30, type=float, help="Timeout of API calls in seconds. Defaults to 30")
+    parser.add_argument('--retries', dest="retries", default=3, type=int, help="Number of retries of failed API calls, with exponential backoff. Defaults to 3")
+    parser.add_argument('--pool-size', dest="pool_size", default=10, type=int, help="Maximum number of connections kept open to each system. Defaults to 10")
+    parser.add_argument('--shard', dest="shard", action='store', default=None, metavar="SHARD/COUNT", help="Only process the systems owned by shard SHARD of COUNT (ie. 1/4), to split a run across several hosts or processes")
+    parser.add_argument('--shard-volumes', dest="shard_volumes", action="store_true", default=False, help="With --shard, process all systems but only the volumes owned by the shard")
+    parser.add_argument('--partial', dest="partial", action='store', default=None, help="Write the results of the run to this file, to be combined with the results of other shards with --merge")
+    parser.add_argument('--merge', dest="merge", action='store', nargs='+', default=None, metavar="PARTIAL", help="Print the report of a sharded run from the files written by each shard with --partial, without contacting systems")
+    parser.add_argument('--stats', dest="stats", nargs='?', const='-', default=None, help="Print timings of API calls per system on stderr, or write them as JSON to STATS")
+    parser.add_argument('-k', dest="ignore_ssl", action="store_true", default=False, help="Ignore SSL errors")
+    parser.add_argument('--debug', '-d', dest="debug", action="store_true", default=False, help="Run in debug mode")
+    return parser
+
+# Returns the default options of a parser, changed by keyword arguments named
+# after the options (ie. check=True for --check), to use the package without
+# the command line
+def parser_options(parser, kwargs):
+    options = parser.parse_args([])
+    for name, value in kwargs.items():
+        if not hasattr(options, name):
+            raise TypeError("Unknown option '%s'" % name)
+        setattr(options, name, value)
+    return options
+
+# Returns options of ontap-extend-snaplock-expiry.py, see parser_options
+def extend_options(**kwargs):
+    return parser_options(extend_parser(), kwargs)
+
+# Returns options of ontap-sum-snapshot-delta.py, see parser_options
+def delta_options(**kwargs):
+    return parser_options(delta_parser(), kwargs)
+
+# Common setup of both commands : debug logging, SSL warnings and
+# configuration file
+# Returns the configuration
+def setup(args):
+    # Enable debug
+    if args.debug:
+        logging.basicConfig(level=logging.DEBUG)
+
+    # If -k is used, ignore SSL warnings
+    if args.ignore_ssl:
+        import urllib3
+        logging.debug("Disabling SSL warnings")
+        urllib3.disable_warnings()
+
+    # Read configuration file
+    with open(args.config,'r') as configfile:
+        logging.debug("Opening Configuration file %s" % args.config)
+        config = json.load(configfile)
+
+    logging.debug("Snapmirror labels are {0}".format(", ".join(config['labels-policies'].keys())))
+    return config
+
+# Print or write the timings of API calls with --stats
+def write_stats(args, call_stats):
+    if args.stats:
+        try:
+            call_stats.write(args.stats, sys.stderr)
+        except (IOError, OSError) as e:
+            eprint("Unable to write statistics to %s" % args.stats)
+            eprint(e)
+
+# Check the sharding options
+# Returns the shard as returned by parse_shard, or None
+def check_shard(parser, args):
+    if args.merge and (args.shard or args.partial):
+        parser.error("--merge can't be used with --shard or --partial")
+    if args.shard_volumes and not args.shard:
+        parser.error("--shard-volumes requires --shard")
+    if not args.shard:
+        return None
+    from ontap_snaplock.shard import parse_shard
+    try:
+        return parse_shard(args.shard)
+    except ValueError as e:
+        parser.error(str(e))
+
+# Returns the systems processed by a shard, in the order of the configuration
+# With --shard-volumes, all systems are processed.
+def shard_systems(config, args, shard):
+    if shard is None or args.shard_volumes:
+        return config["systems"]
+    from ontap_snaplock.shard import owns
+    return [system for system in config["systems"] if owns(shard, system["ip"])]
+
+# Returns a function telling if a shard owns the snapshot delta cache entries
+# of a cluster, vserver and volume, or None if the run isn't sharded
+def cache_owner(args, shard):
+    if shard is None:
+        return None
+    from ontap_snaplock.shard import owns
+    if args.shard_volumes:
+        return lambda cluster, vserver, volume: owns(shard, cluster, vserver, volume)
+    return lambda cluster, vserver, volume: owns(shard, cluster)
+
+# Returns the PartialWriter of --partial, or None
+def partial_writer(args, script, shard):
+    if not args.partial:
+        return None
+    from ontap_snaplock.shard import PartialWriter
+    return PartialWriter(args.partial, script, shard)
+
+# Read the partial files of --merge and add their statistics to call_stats
+# Returns the records of the partial files, or None on error
+def merge_partials(args, script, call_stats):
+    from ontap_snaplock.shard import read_partials
+    try:
+        records = read_partials(args.merge, script)
+    except (IOError, OSError, ValueError) as e:
+        eprint("Unable to read partial results")
+        eprint(e)
+        return None
+    for record in records.get("stats", []):
+        call_stats.load(record["stats"])
+    return records
+
+# Print the compliance of each system from the partial results of the shards
+# of ontap-extend-snaplock-expiry.py
+# With --shard-volumes, a system is not compliant if any of its shards found
+# a volume not compliant, and in error if any of them failed.
+def extend_merge(args, config, call_stats):
+    records = merge_partials(args, "extend", call_stats)
+    if records is None:
+        return 1
+
+    results = {}
+    for record in records.get("compliance", []):
+        results.setdefault(record["system"], []).append(record["compliance"])
+    for system in config["systems"]:
+        compliances = results.get(system["ip"])
+        if compliances is None:
+            eprint("No partial result for system %s" % system["ip"])
+            compliance = "error"
+        elif "non-compliant" in compliances:
+            compliance = "non-compliant"
+        elif "error" in compliances:
+            compliance = "error"
+        else:
+            compliance = "compliant"
+        print("%s\t%s" % (system["ip"],compliance))
+
+    write_stats(args, call_stats)
+    return 0
+
+# Run ontap-extend-snaplock-expiry.py
+# Returns the exit code
+def extend_main(argv=None):
+    parser = extend_parser()
+    args = parser.parse_args(argv)
+
+    if args.plan and not args.simulate:
+        parser.error("--plan requires --simulate")
+    if args.apply_plan and (args.check or args.plan):
+        parser.error("--apply-plan can't be used with --check or --plan")
+    if args.exporter and (args.check or args.simulate or args.plan or args.apply_plan or args.state):
+        parser.error("--exporter can't be used with --check, --simulate, --plan, --apply-plan or --state")
+    if args.merge and (args.check or args.simulate or args.apply_plan or args.exporter or args.state):
+        parser.error("--merge can't be used with --check, --simulate, --apply-plan, --exporter or --state")
+    if args.exporter and (args.shard or args.partial):
+        parser.error("--exporter can't be used with --shard or --partial")
+    shard = check_shard(parser, args)
+    if args.exporter:
+        address, _, port = args.exporter.rpartition(':')
+        try:
+            port = int(port)
+        except ValueError:
+            parser.error("--exporter expects [ADDRESS:]PORT")
+
+    # Notify if we're running in simulate mode
+    if args.simulate:
+        eprint("Running in simulate mode")
+
+    config = setup(args)
+
+    from ontap_snaplock import stats
+
+    if args.merge:
+        return extend_merge(args, config, stats.CallStats())
+
+    from ontap_snaplock.extend import Extender
+    from ontap_snaplock.state import StateIndex
+
+    # Open the state index
+    state = None
+    if args.state:
+        state = StateIndex(args.state)
+
+    # Timings of API calls. The exporter runs forever, so it only keeps the
+    # latest timings of each call for percentiles
+    call_stats = stats.CallStats(max_samples=args.exporter and 1000 or None)
+
+    extender = Extender(config, args, state, call_stats)
+
+    # Apply a plan without listing snapshots
+    if args.apply_plan:
+        import collections
+        # Changes of systems owned by other shards are skipped, changes of
+        # systems missing from the configuration are reported by apply_plan
+        owned = set(system["ip"] for system in shard_systems(config, args, shard))
+        configured = set(system["ip"] for system in config["systems"])
+        plan = collections.OrderedDict()
+        with open(args.apply_plan,'r') as planfile:
+            logging.debug("Opening plan %s" % args.apply_plan)
+            for line in planfile:
+                if line.strip():
+                    change = json.loads(line)
+                    if change['system'] in owned or change['system'] not in configured:
+                        plan.setdefault(change.pop('system'),[]).append(change)
+
+        extender.apply_plan(plan)
+        write_stats(args, call_stats)
+        return 0
+
+    # Run as a Prometheus exporter until interrupted
+    if args.exporter:
+        import time
+        server = extender.export(config["systems"], address, port)
+        eprint("Serving metrics on http://%s:%i/metrics" % (address or "0.0.0.0", port))
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            server.shutdown()
+        return 0
+
+    # Results are in the order of config["systems"] so the check output stays
+    # deterministic
+    systems = shard_systems(config, args, shard)
+    partial = partial_writer(args, "extend", shard)
+    for system, compliance in zip(systems, extender.run(systems)):
+        if args.check:
+            print("%s\t%s" % (system["ip"],compliance))
+        if partial:
+            partial.write("compliance", system=system["ip"], compliance=compliance)
+
+    # Write the plan, in the order of config["systems"]
+    if args.plan:
+        extender.write_plan(args.plan, systems)
+
+    write_stats(args, call_stats)
+    if partial:
+        partial.write("stats", stats=call_stats.dump())
+        partial.close()
+
+    # Save the state index for the next run
+    if state is not None:
+        try:
+            state.save()
+        except (IOError, OSError) as e:
+            eprint("Unable to save state index %s" % args.state)
+            eprint(e)
+    return 0
+
+# Run ontap-sum-snapshot-delta.py
+# Returns the exit code
+def delta_main(argv=None):
+    parser = delta_parser()
+    args = parser.parse_args(argv)
+    shard = check_shard(parser, args)
+    config = setup(args)
+
+    from ontap_snaplock import stats
+
+    if args.merge:
+        return delta_merge(args, config, stats.CallStats())
+
+    import sqlite3
+    from ontap_snaplock.cache import DeltaCache
+    from ontap_snaplock.delta import DeltaSummarizer
+
+    # Open the snapshot delta cache
+    # A sharded run only evicts or empties the entries it owns
+    cache = None
+    owner = cache_owner(args, shard)
+    if not args.no_cache:
+        try:
+            cache = DeltaCache(args.cache)
+            if args.rebuild_cache:
+                logging.debug("Emptying snapshot delta cache %s" % args.cache)
+                cache.clear(owner)
+        except sqlite3.Error as e:
+            eprint("Unable to open snapshot delta cache %s, continuing without cache (%s)" % (args.cache,e))
+            cache = None
+
+    # Timings of API calls
+    call_stats = stats.CallStats()
+
+    partial = partial_writer(args, "delta", shard)
+    DeltaSummarizer(config, args, cache, call_stats, partial=partial, cache_owner=owner).run(shard_systems(config, args, shard))
+
+    if cache:
+        eprint("Snapshot delta cache : %(hits)i hits, %(misses)i misses, %(evicted)i evicted" % cache.stats())
+        cache.close()
+
+    write_stats(args, call_stats)
+    if partial:
+        partial.write("stats", stats=call_stats.dump())
+        partial.close()
+    return 0
+
+# Print the report of ontap-sum-snapshot-delta.py from the partial results of
+# the shards, systems in the order of the configuration and volumes in the
+# order they were listed
+def delta_merge(args, config, call_stats):
+    records = merge_partials(args, "delta", call_stats)
+    if records is None:
+        return 1
+
+    from ontap_snaplock.report import ReportWriter
+
+    report = ReportWriter(sys.stdout, args.format)
+    labels = dict((label, position) for position, label in enumerate(config['labels-policies']))
+    listed = set(record["system"] for record in records.get("system", []))
+    rows = {}
+    for record in records.get("row", []):
+        rows.setdefault(record["system"], []).append((record["index"], record["row"]))
+    for system in config["systems"]:
+        if system["ip"] not in listed and system["ip"] not in rows:
+            continue
+        report.header()
+        # Rows are put back in the order of volumes, then of labels in the
+        # configuration, as --pipeline writes them as they complete
+        for index, row in sorted(rows.get(system["ip"], []), key=lambda r: (r[0], labels.get(r[1][2], len(labels)))):
+            report.row([system["ip"]] + row)
+
+    write_stats(args, call_stats)
+    return 0
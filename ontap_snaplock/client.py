@@ -0,0 +1,125 @@
+import logging
+import base64
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from ontap_snaplock.stats import OTHER
+
+# HTTP status codes that are retried with exponential backoff
+retry_status_codes = (429, 500, 502, 503, 504)
+
+# Persistent connection to an ONTAP system
+#
+# All API calls to a system go through the same requests.Session, so TCP and
+# TLS connections (including mutual TLS with client certificates) are reused
+# across calls instead of being established for each request.
+class OntapClient(object):
+
+    # Timings of all calls are recorded in call_stats (a CallStats) if set
+    def __init__(self, system, verify=True, timeout=30, retries=3, backoff=0.5, pool_size=10, call_stats=None):
+        self.system = system
+        self.ip = system["ip"]
+        self.timeout = timeout
+        self.verify = verify
+        self.call_stats = call_stats
+
+        self.session = requests.Session()
+
+        if "certificate" in system:
+            self.session.cert = (system["certificate"], system["key"])
+            logging.debug("Using certificate-based authentication for %s" % self.ip)
+        elif "password-base64" in system:
+            self.session.auth = (system["username"],base64.b64decode(system["password-base64"]))
+        else:
+            logging.warning("Password not base64-encoded in config file (%s)" % self.ip)
+            self.session.auth = (system["username"],system["password"])
+
+        # Retry on connection errors and throttling/server errors, including
+        # POST as all the calls we make can safely be replayed
+        retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=retry_status_codes,
+                      allowed_methods=None, raise_on_status=False)
+        self.adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("https://", self.adapter)
+
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    # Returns the full URL of an API path
+    def url(self, path):
+        return 'https://%s%s' % (self.ip, path)
+
+    # category is one of the categories of ontap_snaplock.stats, used to
+    # aggregate call timings
+    # For streamed responses, the time recorded is the time until headers are
+    # received, and the size is recorded by close_response once the body is
+    # read, as chunked responses have no Content-Length
+    def request(self, method, path, category=OTHER, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        # verify is passed on every call as REQUESTS_CA_BUNDLE in the
+        # environment would otherwise take precedence over session.verify
+        kwargs.setdefault("verify", self.verify)
+        url = self.url(path)
+        logging.debug("API CALL : %s %s", method, url)
+        with self.lock:
+            self.requests += 1
+        start = time.time()
+        try:
+            r = self.session.request(method, url, **kwargs)
+        except Exception:
+            if self.call_stats is not None:
+                self.call_stats.record(self.ip, category, time.time() - start, error=True)
+            raise
+        if self.call_stats is not None:
+            size = 0
+            if not kwargs.get("stream"):
+                size = len(r.content)
+            self.call_stats.record(self.ip, category, time.time() - start, size, r.status_code >= 400)
+        return r
+
+    # Close a streamed response, recording the bytes read from it in the
+    # category of the call
+    def close_response(self, r, category=OTHER):
+        size = r.raw.tell()
+        r.close()
+        if self.call_stats is not None:
+            self.call_stats.record_bytes(self.ip, category, size)
+
+    def get(self, path, category=OTHER, **kwargs):
+        return self.request("GET", path, category, **kwargs)
+
+    def post(self, path, category=OTHER, **kwargs):
+        return self.request("POST", path, category, **kwargs)
+
+    # Returns connection reuse statistics for this system
+    # - requests : API calls made through the client
+    # - attempts : HTTP requests sent, including retries
+    # - connections : TCP/TLS connections established
+    # - reused : HTTP requests sent on an already established connection
+    def stats(self):
+        attempts = 0
+        connections = 0
+        for key in list(self.adapter.poolmanager.pools.keys()):
+            pool = self.adapter.poolmanager.pools.get(key)
+            if pool is None:
+                continue
+            attempts += pool.num_requests
+            connections += pool.num_connections
+        return {
+            "requests": self.requests,
+            "attempts": attempts,
+            "connections": connections,
+            "reused": attempts - connections,
+        }
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,567 @@
+import collections
+import concurrent.futures
+import json
+import logging
+import multiprocessing
+import queue
+import re
+import sys
+import threading
+import xml.etree.ElementTree as ET
+
+import requests
+
+from ontap_snaplock import _protect, eprint, stats
+from ontap_snaplock.client import OntapClient
+from ontap_snaplock.report import ReportWriter
+from ontap_snaplock.shard import owns, parse_shard
+
+ontapi_url = "/servlets/netapp.servlets.admin.XMLrequest_filer"
+
+# Using ONTAPI instead of REST as REST lacks the following features :
+# - Get a list of all the snapshots in the system having a particular
+#   snapmirror-label.
+# - Get the snapshot delta between two snapshots
+#
+# It was easier to implement using a direct XML string than ask for the user to
+# install NMSDK
+
+ontapi_snapshots_list = """<?xml version="1.0" encoding="UTF-8"?>
+<netapp  xmlns="http://www.netapp.com/filer/admin" version="1.170">
+  <snapshot-get-iter>
+    <desired-attributes>
+      <snapshot-info>
+        <name></name>
+        <snapshot-instance-uuid></snapshot-instance-uuid>
+        <volume></volume>
+        <volume-provenance-uuid></volume-provenance-uuid>
+        <vserver></vserver>
+        <snapmirror-label></snapmirror-label>
+        <access-time></access-time>
+      </snapshot-info>
+    </desired-attributes>
+    <query>
+      <snapshot-info>
+        <snapmirror-label>{snapmirror_label}</snapmirror-label>
+      </snapshot-info>
+    </query>
+    <max-records>{max_records}</max-records>
+    <tag>{tag}</tag>
+  </snapshot-get-iter>
+</netapp>
+"""
+
+ontapi_snapshots_delta="""<?xml version="1.0" encoding="UTF-8"?>
+<netapp  xmlns="http://www.netapp.com/filer/admin" version="1.170" vfiler="{0}">
+  <snapshot-delta-info>
+    <snapshot1>{1}</snapshot1>
+    <snapshot2>{2}</snapshot2>
+    <volume>{3}</volume>
+  </snapshot-delta-info>
+</netapp>
+"""
+
+ontapi_ns = "{http://www.netapp.com/filer/admin}"
+
+# Tag of the next page in a raw snapshot-get-iter response, already escaped to
+# be sent back in the next request
+next_tag_re = re.compile(br"<next-tag>(.*?)</next-tag>", re.S)
+
+# Raised when ONTAPI returns a failed status
+class OntapiError(Exception):
+    pass
+
+# Returns a snapshot record (vserver, volume, label, create_time, name, uuid)
+# from a snapshot-info element
+# access-time is the creation time of the snapshot, in seconds since epoch
+def snapshot_record(elem):
+    return (elem.findtext(ontapi_ns + "vserver"), elem.findtext(ontapi_ns + "volume"), elem.findtext(ontapi_ns + "snapmirror-label"),
+            int(elem.findtext(ontapi_ns + "access-time") or 0), elem.findtext(ontapi_ns + "name"), elem.findtext(ontapi_ns + "snapshot-instance-uuid"))
+
+# Group snapshot records by volume
+#
+# Records are added in the order they are listed, and the snapshots of a
+# volume are returned as (vserver, volume, {label: [(create_time, name,
+# uuid)]}) as soon as the records of another volume start, so we never hold
+# the snapshots of the whole system in memory.
+# This relies on snapshot-get-iter returning snapshots ordered by vserver and
+# volume.
+class VolumeGrouper(object):
+
+    def __init__(self):
+        self.current = None
+        self.labels = {}
+        self.done = set()
+
+    # Add a record
+    # Returns the previous volume if this record starts a new one, or None
+    def add(self, record):
+        vserver, volume, label, create_time, name, uuid = record
+        completed = None
+        if (vserver,volume) != self.current:
+            if self.current is not None:
+                self.done.add(self.current)
+                completed = (self.current[0], self.current[1], self.labels)
+            if (vserver,volume) in self.done:
+                logging.warning("Snapshots of volume %s on vserver %s were not returned together, the volume will be reported more than once" % (volume,vserver))
+            self.current = (vserver,volume)
+            self.labels = {}
+        self.labels.setdefault(label,[]).append((create_time,name,uuid))
+        return completed
+
+    # Returns the last volume once all records were added, or None
+    def finish(self):
+        if self.current is None:
+            return None
+        return (self.current[0], self.current[1], self.labels)
+
+# Iterate over the snapshots with any of the given labels in a system, grouped
+# by volume (see VolumeGrouper)
+#
+# Pages are parsed incrementally from the HTTP response as they are received,
+# and a volume is yielded as soon as all its snapshots have been read.
+def iter_volume_snapshots(client, labels, max_records=500):
+    grouper = VolumeGrouper()
+
+    tag=""
+    finished=False
+    while not finished:
+        data = ontapi_snapshots_list.format(snapmirror_label="|".join(labels),max_records=max_records,tag=tag)
+        logging.debug("Raw query: %s", data)
+
+        r = client.post(ontapi_url, stats.SNAPSHOT_GET_ITER, data=data, stream=True)
+        r.raise_for_status()
+        r.raw.decode_content = True
+
+        tag = None
+        parent = None
+        # The response is also closed if parsing fails or the caller stops
+        # iterating, so its connection goes back to the pool
+        try:
+            for event, elem in ET.iterparse(r.raw, events=("start","end")):
+                if event == "start":
+                    if elem.tag == ontapi_ns + "attributes-list":
+                        parent = elem
+                    continue
+
+                if elem.tag == ontapi_ns + "snapshot-info" and parent is not None:
+                    record = snapshot_record(elem)
+                    parent.remove(elem)
+                    completed = grouper.add(record)
+                    if completed is not None:
+                        yield completed
+                elif elem.tag == ontapi_ns + "next-tag":
+                    # Tag contains html entities to be replaced to be fed again
+                    # in the next request when paging results
+                    tag = elem.text.replace("<","&lt;").replace(">","&gt;")
+                elif elem.tag == ontapi_ns + "results" and elem.get("status") != "passed":
+                    raise OntapiError(elem.get("reason"))
+        finally:
+            client.close_response(r, stats.SNAPSHOT_GET_ITER)
+
+        if tag is None:
+            finished = True
+
+    completed = grouper.finish()
+    if completed is not None:
+        yield completed
+
+# Parse a page of snapshot-get-iter, in a process of the parser pool with
+# --pipeline
+# Returns the snapshot records of the page (see snapshot_record), and the
+# reason of the failure if ONTAPI returned a failed status
+def parse_snapshot_page(content):
+    root = ET.fromstring(content)
+    results = root.find(ontapi_ns + "results")
+    if results is None or results.get("status") != "passed":
+        return [], results is not None and results.get("reason") or "No results"
+    return [snapshot_record(elem) for elem in results.iterfind(ontapi_ns + "attributes-list/" + ontapi_ns + "snapshot-info")], None
+
+# Get the size of the delta between two snapshots of a volume
+# Returns None if the delta couldn't be retrieved, so a failed pair doesn't
+# stop the other pairs of the system
+def get_delta(client, vserver, volume, snapshot1, snapshot2):
+    data = ontapi_snapshots_delta.format(vserver,snapshot1,snapshot2,volume)
+    r = client.post(ontapi_url, stats.SNAPSHOT_DELTA_INFO, data=data)
+    """
+    <?xml version='1.0' encoding='UTF-8' ?>
+    <!DOCTYPE netapp SYSTEM 'file:/etc/netapp_gx.dtd'>
+    <netapp version='1.170' xmlns='http://www.netapp.com/filer/admin'>
+    <results status="passed"><consumed-size>393216</consumed-size><elapsed-time>86400</elapsed-time></results></netapp>%
+    """
+    if r.status_code != 200:
+        eprint("Failed to get snapshot delta between %s and %s for volume %s on svm %s on %s (Code %i : %s)" % (snapshot1,snapshot2,volume,vserver,client.ip,r.status_code,r.reason))
+        return None
+    try:
+        root = ET.fromstring(r.content)
+        return int(root.find(".//{http://www.netapp.com/filer/admin}consumed-size").text)
+    except (AttributeError, ET.ParseError):
+        sys.stderr.write('Exception occurred while getting snapshot size of %s and %s for volume %s on svm %s on %s\n' % (snapshot1,snapshot2,volume,vserver,client.ip))
+        sys.stderr.write('Root :\n')
+        sys.stderr.write(r.content.decode("utf-8", "replace") )
+        return None
+
+# Submit a call to the executor, waiting for a slot in the in_flight
+# semaphore so we never queue more calls than we can handle
+def submit(executor, in_flight, fn, *args):
+    in_flight.acquire()
+    future = executor.submit(fn, *args)
+    future.add_done_callback(lambda f: in_flight.release())
+    return future
+
+# Queue of the (kind, value) events of DeltaSummarizer.iter_pipelined_rows
+# Rows and errors are returned before pages and the end of listing, so output
+# isn't held back by listing, other events are returned in order.
+class PriorityEvents(object):
+
+    urgent = ("row", "error")
+
+    def __init__(self):
+        self.queue = queue.PriorityQueue()
+        self.lock = threading.Lock()
+        self.sequence = 0
+
+    def put(self, event):
+        with self.lock:
+            self.sequence += 1
+            sequence = self.sequence
+        self.queue.put((event[0] not in self.urgent, sequence, event))
+
+    # Raises queue.Empty if block is False and there is no event
+    def get(self, block=True):
+        return self.queue.get(block)[2]
+
+# Sum of the deltas between consecutive snapshots of each snapmirror label,
+# per volume
+#
+# options are the options of ontap-sum-snapshot-delta.py, as returned by
+# ontap_snaplock.cli.delta_options(). cache is an optional DeltaCache,
+# call_stats an optional CallStats collecting timings of API calls, partial
+# an optional PartialWriter receiving the rows of each system with --partial,
+# and cache_owner an optional function telling if a (cluster, vserver,
+# volume) belongs to this run, so a sharded run only evicts its own cache
+# entries (see ontap_snaplock.cli.cache_owner).
+#
+# Snapshots of a label are paired in the order they were created. Rows are
+# written to output in options.format, or can be iterated with iter_rows,
+# ie. :
+#
+#   summarizer = DeltaSummarizer(config, cli.delta_options())
+#   with summarizer.connect(system) as client:
+#       for vserver, volume, label, count, size in summarizer.iter_rows(client):
+#           ...
+class DeltaSummarizer(object):
+
+    def __init__(self, config, options, cache=None, call_stats=None, output=None, partial=None, cache_owner=None):
+        self.config = config
+        self.options = options
+        self.cache = cache
+        self.cache_owner = cache_owner
+        self.call_stats = call_stats or stats.CallStats()
+        self.report = ReportWriter(output or sys.stdout, options.format, flush=options.pipeline)
+        self.partial = partial
+        self.labels = list(config['labels-policies'].keys())
+
+        # With --shard-volumes, every shard processes all systems but only
+        # the volumes it owns
+        self.volume_shard = None
+        if options.shard and options.shard_volumes:
+            self.volume_shard = parse_shard(options.shard)
+
+    # Returns a new OntapClient for a system, to be closed after use
+    def connect(self, system):
+        return OntapClient(system, verify=not self.options.ignore_ssl, timeout=self.options.timeout, retries=self.options.retries,
+                           pool_size=self.options.pool_size, call_stats=self.call_stats)
+
+    # Iterate over the rows of a system, as (vserver, volume, label, count,
+    # size), in the order snapshots are listed
+    def iter_rows(self, client):
+        for index, row in self.iter_indexed_rows(client):
+            yield row
+
+    # Returns the snapshot pairs of each label of a volume, as a list of
+    # ((vserver, volume, label, count), pairs), where pairs are
+    # ((name1, uuid1), (name2, uuid2), size) of consecutive snapshots in order
+    # of creation
+    # Sizes are either known from the cache, or futures of calls to get_delta
+    # submitted to the executor.
+    def volume_pairs(self, client, executor, in_flight, vserver, volume, labels):
+        logging.debug("Volume: %s on vserver %s", volume, vserver)
+        groups = []
+        for label in self.labels:
+            if label not in labels:
+                continue
+            logging.debug("Label: %s" % label)
+            snap = sorted(labels[label])
+            logging.debug("Snapshots: %s", snap)
+
+            l = len(snap)
+            if l < 2:
+                continue
+            pairs = []
+            for i in range(l-1):
+                (time1,name1,uuid1),(time2,name2,uuid2) = snap[i],snap[i+1]
+                size = self.cache and self.cache.get(client.ip,vserver,volume,name1,name2,uuid1,uuid2)
+                if size is None:
+                    size = submit(executor, in_flight, get_delta, client, vserver, volume, name1, name2)
+                pairs.append(((name1,uuid1),(name2,uuid2),size))
+            groups.append(((vserver,volume,label,l),pairs))
+        return groups
+
+    # Returns the sum of the deltas of snapshot pairs once they are all known
+    # Deltas retrieved from the system are added to the cache.
+    def sum_pairs(self, client, vserver, volume, pairs):
+        size = 0
+        for (name1,uuid1),(name2,uuid2),delta in pairs:
+            if isinstance(delta, concurrent.futures.Future):
+                delta = delta.result()
+                if self.cache and delta is not None:
+                    self.cache.put(client.ip,vserver,volume,name1,name2,delta,uuid1,uuid2)
+            size = size + (delta or 0)
+        return size
+
+    # Iterate over the rows of a system, as (index, (vserver, volume, label,
+    # count, size)) where index is the position of the volume in the snapshot
+    # list, so rows of several shards can be put back in order
+    #
+    # Deltas of all the snapshot pairs of all the volumes are retrieved in
+    # parallel, at most options.workers at the same time, while rows are
+    # yielded in order as soon as all the deltas of a (vserver, volume, label)
+    # are known. Volumes are sent to the delta workers as soon as their list of
+    # snapshots is complete.
+    # With volume sharding, only the volumes owned by the shard are processed.
+    def iter_indexed_rows(self, client):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.options.workers) as executor:
+            in_flight = threading.BoundedSemaphore(self.options.workers * 2)
+            pending = collections.deque()
+
+            for index, (vserver, volume, labels) in enumerate(iter_volume_snapshots(client, self.labels, self.options.max_records)):
+                if not owns(self.volume_shard, client.ip, vserver, volume):
+                    continue
+                for group in self.volume_pairs(client, executor, in_flight, vserver, volume, labels):
+                    pending.append((index,) + group)
+                    for row in self.completed_rows(client, pending, wait=False):
+                        yield row
+
+            for row in self.completed_rows(client, pending, wait=True):
+                yield row
+
+    # Returns the rows of pending (index, (vserver, volume, label, count),
+    # pairs) in order, as long as all their deltas are known. If wait is True,
+    # wait for all of them.
+    def completed_rows(self, client, pending, wait):
+        rows = []
+        while pending and (wait or all(not isinstance(size, concurrent.futures.Future) or size.done() for s1,s2,size in pending[0][2])):
+            index,(vserver,volume,label,l),pairs = pending.popleft()
+            rows.append((index,(vserver,volume,label,l,self.sum_pairs(client, vserver, volume, pairs))))
+        return rows
+
+    # List the snapshots of a system page by page for iter_pipelined_rows
+    #
+    # Raw pages are sent to the parser pool as soon as they are received, and
+    # the next page is requested right away with the tag found in the raw
+    # response, so listing and parsing overlap. Futures of the parsed pages
+    # are put in pages, in order, followed by None. Errors are put in events.
+    # Puts give up once stop is set, as pages may not be collected anymore.
+    def list_pages(self, client, parsers, pages, events, stop):
+        def put(page):
+            while not stop.is_set():
+                try:
+                    pages.put(page, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+
+        try:
+            tag = ""
+            while tag is not None and not stop.is_set():
+                data = ontapi_snapshots_list.format(snapmirror_label="|".join(self.labels),max_records=self.options.max_records,tag=tag)
+                logging.debug("Raw query: %s", data)
+
+                r = client.post(ontapi_url, stats.SNAPSHOT_GET_ITER, data=data)
+                r.raise_for_status()
+                put(parsers.submit(parse_snapshot_page, r.content))
+
+                match = next_tag_re.search(r.content)
+                tag = match and match.group(1).decode("utf-8") or None
+        except Exception as e:
+            events.put(("error", e))
+        finally:
+            put(None)
+
+    # Collect the parsed pages of list_pages in order, and put them in events
+    # as ("page", records), followed by ("listed", None)
+    # A slot is taken before each page is put, and released by
+    # iter_pipelined_rows once the volumes of the page are dispatched, so
+    # listing doesn't run ahead of delta retrieval. Returns once stop is set.
+    def collect_pages(self, pages, events, slots, stop):
+        while not stop.is_set():
+            try:
+                page = pages.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if page is None:
+                events.put(("listed", None))
+                return
+            try:
+                records, failure = page.result()
+            except Exception as e:
+                events.put(("error", e))
+                continue
+            if failure is not None:
+                events.put(("error", OntapiError(failure)))
+                continue
+            while not slots.acquire(timeout=0.1):
+                if stop.is_set():
+                    return
+            events.put(("page", records))
+
+    # Iterate over the rows of a system like iter_indexed_rows, with
+    # --pipeline
+    #
+    # Listing, parsing, delta retrieval and sums run as separate stages :
+    # - pages of snapshots are listed by a thread, and parsed by a pool of
+    #   options.parsers processes so parsing large systems uses several cores
+    # - volumes are grouped and dispatched to options.workers delta threads as
+    #   soon as their snapshots are parsed
+    # - a row is yielded as soon as all the deltas of its volume and label are
+    #   known, in the order rows complete rather than the order of volumes
+    # The cache is only used from the calling thread. Parser processes are
+    # started with forkserver (spawn where it isn't available), as forking
+    # this process while the listing threads run could deadlock them.
+    def iter_pipelined_rows(self, client):
+        events = PriorityEvents()
+        pages = queue.Queue(maxsize=self.options.parsers * 2)
+        slots = threading.Semaphore(self.options.parsers * 2)
+        stop = threading.Event()
+        grouper = VolumeGrouper()
+        lock = threading.Lock()
+        remaining = {}
+
+        # Signal a row once all the deltas of its volume and label are known
+        def done(group, future):
+            with lock:
+                remaining[id(group)] -= 1
+                if remaining[id(group)]:
+                    return
+                del remaining[id(group)]
+            events.put(("row", group))
+
+        method = "forkserver" in multiprocessing.get_all_start_methods() and "forkserver" or "spawn"
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self.options.parsers, mp_context=multiprocessing.get_context(method)) as parsers, \
+             concurrent.futures.ThreadPoolExecutor(max_workers=self.options.workers) as executor:
+            in_flight = threading.BoundedSemaphore(self.options.workers * 2)
+            lister = threading.Thread(target=self.list_pages, args=(client, parsers, pages, events, stop), name="list-%s" % client.ip)
+            collector = threading.Thread(target=self.collect_pages, args=(pages, events, slots, stop), name="parse-%s" % client.ip)
+            lister.daemon = collector.daemon = True
+            lister.start()
+            collector.start()
+
+            # Volumes are numbered in the order they are listed, and rows
+            # dispatched but not yielded yet are counted in outstanding
+            volumes = [0]
+            outstanding = [0]
+            def dispatch(completed):
+                index = volumes[0]
+                volumes[0] += 1
+                vserver, volume, labels = completed
+                if not owns(self.volume_shard, client.ip, vserver, volume):
+                    return
+                for group in self.volume_pairs(client, executor, in_flight, vserver, volume, labels):
+                    group = (index,) + group
+                    outstanding[0] += 1
+                    futures = [size for s1,s2,size in group[2] if isinstance(size, concurrent.futures.Future)]
+                    if not futures:
+                        events.put(("row", group))
+                        continue
+                    with lock:
+                        remaining[id(group)] = len(futures)
+                    for future in futures:
+                        future.add_done_callback(lambda future, group=group: done(group, future))
+
+            # Volumes grouped but not dispatched yet, one at a time so rows
+            # completed meanwhile are yielded first. None releases the slot of
+            # a page.
+            ready = collections.deque()
+            try:
+                listed = False
+                while not listed or outstanding[0] or ready:
+                    try:
+                        kind, value = events.get(block=not ready)
+                    except queue.Empty:
+                        completed = ready.popleft()
+                        if completed is None:
+                            slots.release()
+                        else:
+                            dispatch(completed)
+                        continue
+                    if kind == "page":
+                        for record in value:
+                            completed = grouper.add(record)
+                            if completed is not None:
+                                ready.append(completed)
+                        ready.append(None)
+                    elif kind == "listed":
+                        listed = True
+                        completed = grouper.finish()
+                        if completed is not None:
+                            ready.append(completed)
+                    elif kind == "row":
+                        outstanding[0] -= 1
+                        index,(vserver,volume,label,l),pairs = value
+                        yield index, (vserver,volume,label,l,self.sum_pairs(client, vserver, volume, pairs))
+                    elif kind == "error":
+                        raise value
+            finally:
+                stop.set()
+                lister.join()
+                collector.join()
+
+    # Write the report of a system, with its header
+    # Returns False if the system couldn't be processed
+    def process_system(self, system):
+        logging.debug("Checking system '%s'" % json.dumps(_protect(system)))
+
+        with self.connect(system) as client:
+            # The header is written with the first row, so systems that can't
+            # be reached don't get one
+            header = False
+            try:
+                rows = self.options.pipeline and self.iter_pipelined_rows(client) or self.iter_indexed_rows(client)
+                for index, row in rows:
+                    if not header:
+                        self.report.header()
+                        header = True
+                    self.report.row((system["ip"],) + row)
+                    if self.partial:
+                        self.partial.write("row", system=system["ip"], index=index, row=row)
+                if not header:
+                    self.report.header()
+                if self.partial:
+                    self.partial.write("system", system=system["ip"])
+
+            except requests.exceptions.SSLError:
+                # Handle SSL exception
+                eprint("Certificate verification failed for %s. Use -k or add appropriate CA to system configuration" % system["ip"])
+                return False
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                # Handle other connection errors
+                eprint("Unable to connect to %s" % system["ip"])
+                eprint(str(e))
+                return False
+            except (requests.exceptions.HTTPError, OntapiError, ET.ParseError) as e:
+                eprint("Failed to get snapshots on %s (%s)" % (system["ip"],e))
+                return False
+
+            if self.cache:
+                self.cache.evict(system["ip"], self.cache_owner)
+                self.cache.commit()
+
+            logging.debug("Connection statistics for %s : %s", system["ip"], client.stats())
+            self.call_stats.record_connections(system["ip"], client.stats())
+        return True
+
+    # Write the report of all configured systems, one after the other
+    def run(self, systems):
+        for system in systems:
+            self.process_system(system)
@@ -0,0 +1,164 @@
+import logging
+import threading
+import urllib.parse
+
+from ontap_snaplock import eprint, stats
+from ontap_snaplock.evaluation import parse_time
+
+# Fields needed to evaluate a snapshot, requested directly in the snapshot
+# list so we don't need a GET per snapshot
+snapshot_fields = "name,create_time,snaplock_expiry_time,snapmirror_label,svm.name,volume.name,volume.uuid"
+
+# In check mode, only the fields needed to decide compliance are requested,
+# newest snapshots first as they are the most likely not to be extended yet
+check_snapshot_fields = "create_time,snaplock_expiry_time,snapmirror_label,volume.uuid"
+check_order = '&order_by=%s' % urllib.parse.quote('create_time desc')
+
+# Returns the query parameter to only list snapshots created since a watermark
+def watermark_query(watermark):
+    if watermark is None:
+        return ''
+    return '&create_time=%s' % urllib.parse.quote('>=' + watermark, safe='')
+
+# Iterate over the pages of records of a collection, following _links.next
+# to the next page until the last one. Pages are only retrieved when the
+# previous one has been consumed.
+# The status code of the last call is kept in listing["status_code"], and
+# iteration stops if a page can't be retrieved
+def iter_pages(client, url, listing, category=stats.SNAPSHOT_LIST):
+    while url:
+        r = client.get(url, category)
+        listing["status_code"] = r.status_code
+        if r.status_code != 200:
+            logging.debug("API CALL failed (Code %i : %s)" % (r.status_code,r.reason))
+            return
+        page = r.json()
+        yield page.get('records',[])
+        if 'next' in page.get('_links',{}):
+            url = page['_links']['next']['href']
+        else:
+            url = None
+
+# Get all the records of a collection
+# Returns the records and the status code of the last call. Records are None
+# if any of the pages can't be retrieved
+def get_records(client, url, category=stats.SNAPSHOT_LIST):
+    listing = {"status_code": 200}
+    records = [record for page in iter_pages(client, url, listing, category) for record in page]
+    if listing["status_code"] != 200:
+        return None, listing["status_code"]
+    return records, 200
+
+# Discovery of SnapLock volumes and of their snapshots with configured
+# snapmirror labels
+#
+# watermark is a function (client, volume_uuid, label) returning the creation
+# time from which snapshots need to be listed, or None to list them all.
+# With check, snapshots are listed newest first with only the fields needed
+# to decide compliance.
+class Discovery(object):
+
+    def __init__(self, labels, max_records=1000, check=False, watermark=None):
+        self.labels = list(labels)
+        self.max_records = max_records
+        self.check = check
+        self.watermark = watermark or (lambda client, volume_uuid, label: None)
+
+        # Systems that rejected the fields parameter in the snapshot list call
+        self.no_bulk_systems = set()
+        self.no_bulk_lock = threading.Lock()
+
+    # Returns the fields and order of snapshot lists
+    def snapshot_query(self):
+        if self.check:
+            return '&fields=%s%s' % (check_snapshot_fields,check_order)
+        return '&fields=%s' % snapshot_fields
+
+    # List the SnapLock compliance volumes of a system
+    # Returns the response of the API call
+    def list_volumes(self, client):
+        return client.get('/api/storage/volumes?snaplock.type=compliance', stats.VOLUME_LIST)
+
+    # Iterate over the pages of snapshots with a given label in a volume, see
+    # iter_pages
+    # Snapshot details are retrieved in bulk unless the system doesn't support
+    # it, in which case records only have uuid and name
+    def iter_snapshot_pages(self, client, volume_uuid, label, listing):
+        url = '/api/storage/volumes/%s/snapshots?snapmirror_label=%s' % (volume_uuid,label)
+        url += watermark_query(self.watermark(client, volume_uuid, label))
+
+        if client.ip not in self.no_bulk_systems:
+            listed = False
+            for page in iter_pages(client, url + self.snapshot_query() + '&max_records=%i' % self.max_records, listing):
+                listed = True
+                yield page
+            # ONTAP answers 400 on fields it doesn't know about
+            if listed or listing["status_code"] != 400:
+                return
+            with self.no_bulk_lock:
+                if client.ip not in self.no_bulk_systems:
+                    logging.warning("Bulk snapshot retrieval not supported on %s, falling back to one call per snapshot" % client.ip)
+                    self.no_bulk_systems.add(client.ip)
+
+        order = self.check and check_order or ''
+        for page in iter_pages(client, url + order + '&max_records=%i' % self.max_records, listing):
+            yield page
+
+    # List snapshots with a given label in a volume
+    # Returns None on error
+    def list_snapshots(self, client, volume_uuid, label):
+        listing = {"status_code": 200}
+        snapshots = [snapshot for page in self.iter_snapshot_pages(client, volume_uuid, label, listing) for snapshot in page]
+        if listing["status_code"] != 200:
+            return None
+        return snapshots
+
+    # List snapshots with any of the configured labels on all volumes of a
+    # system with a single paginated query, and group them by volume uuid
+    # Returns None if the system doesn't support querying all volumes at once
+    def list_cluster_snapshots(self, client, volume_uuids):
+        if client.ip in self.no_bulk_systems:
+            return None
+
+        url = '/api/storage/volumes/*/snapshots?snapmirror_label=%s%s&max_records=%i' % ("|".join(self.labels),self.snapshot_query(),self.max_records)
+
+        # Only list snapshots created since the oldest watermark, if all
+        # volumes have one
+        watermarks = [self.watermark(client, volume_uuid, label) for volume_uuid in volume_uuids for label in self.labels]
+        if watermarks and None not in watermarks:
+            url += watermark_query(min(watermarks, key=parse_time))
+        snapshots, status_code = get_records(client, url)
+        if snapshots is None:
+            logging.warning("Cluster-wide snapshot query failed on %s (Code %i), querying volumes one by one" % (client.ip,status_code))
+            return None
+
+        # Only keep snaplock volumes, in the order they were listed
+        volume_snapshots = dict((volume_uuid,[]) for volume_uuid in volume_uuids)
+        for snapshot in snapshots:
+            volume_uuid = snapshot['volume']['uuid']
+            if volume_uuid in volume_snapshots:
+                volume_snapshots[volume_uuid].append(snapshot)
+        return volume_snapshots
+
+    # Get the details of snapshots listed without them (see list_snapshots)
+    # In check mode, stops at the first snapshot that can't be retrieved
+    # Returns the details and False if any of the snapshots couldn't be
+    # retrieved
+    def get_snapshot_details(self, client, volume_uuid, snapshots):
+        details = []
+        for snapshot in snapshots:
+            if 'create_time' in snapshot:
+                details.append(snapshot)
+                continue
+
+            t = client.get('/api/storage/volumes/%s/snapshots/%s' % (volume_uuid,snapshot['uuid']), stats.SNAPSHOT_DETAIL)
+            if t.status_code != 200:
+                if self.check:
+                    return details, False
+                eprint("Failed to get snapshot %s for volume %s on %s" % (snapshot['uuid'],volume_uuid,client.ip))
+                continue
+
+            logging.debug("Snapshot details : %s", t.text)
+            details.append(t.json())
+
+        return details, len(details) == len(snapshots)
@@ -0,0 +1,64 @@
+import datetime
+
+# Parse an ONTAP date (ie. 2024-01-01T00:00:00+02:00) to a time zone aware
+# datetime
+# Dates without time zone, like the expiry times of plans written by older
+# releases, are interpreted in tzinfo
+def parse_time(date, tzinfo=None):
+    if date.endswith("Z"):
+        date = date[:-1] + "+00:00"
+    parsed = datetime.datetime.fromisoformat(date)
+    if parsed.tzinfo is None and tzinfo is not None:
+        parsed = parsed.replace(tzinfo=tzinfo)
+    return parsed
+
+# Format a datetime as an ONTAP date, keeping its time zone
+def format_time(date):
+    return date.replace(microsecond=0).isoformat()
+
+# Evaluation of the SnapLock expiry time of snapshots against the policy of
+# their snapmirror label
+#
+# Creation and expiry times are compared with their time zone. Everything that
+# doesn't depend on the snapshot (the retention of each label and the latest
+# expiry time that can be set) is computed when the Evaluator is created, so a
+# new Evaluator should be created for every run.
+class Evaluator(object):
+
+    # policies is the labels-policies of the configuration, in seconds
+    # max_expiry is the maximum expiration time that can be set, in seconds
+    # from now
+    def __init__(self, policies, max_expiry, now=None):
+        self.retentions = dict((label, datetime.timedelta(seconds=seconds)) for label, seconds in policies.items())
+        self.now = now or datetime.datetime.now(datetime.timezone.utc)
+        self.cutoff = self.now + datetime.timedelta(seconds=max_expiry)
+
+    # Evaluate a batch of snapshot records, with create_time,
+    # snaplock_expiry_time and snapmirror_label
+    # Snapshots without SnapLock expiry time, with a label that isn't
+    # configured, or created before the watermark of their label (a dict of
+    # label to datetime) are skipped.
+    # Returns a list of (snapshot, create_time, expiry_time, gap) for the
+    # snapshots evaluated, with the expiry time required by the policy and
+    # the difference in seconds between the current and the required expiry
+    # time, negative if the snapshot is not compliant
+    def evaluate(self, snapshots, watermarks=None):
+        retentions = self.retentions
+        watermarks = watermarks or {}
+        results = []
+        for snapshot in snapshots:
+            retention = retentions.get(snapshot.get('snapmirror_label'))
+            current = snapshot.get('snaplock_expiry_time')
+            if retention is None or not current:
+                continue
+            create_time = parse_time(snapshot['create_time'])
+            watermark = watermarks.get(snapshot['snapmirror_label'])
+            if watermark is not None and create_time < watermark:
+                continue
+            expiry_time = create_time + retention
+            results.append((snapshot, create_time, expiry_time, (parse_time(current) - expiry_time).total_seconds()))
+        return results
+
+    # Returns True if expiry_time is beyond the maximum expiration time
+    def beyond_max_expiry(self, expiry_time):
+        return expiry_time > self.cutoff
@@ -0,0 +1,76 @@
+import logging
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Metrics exposed by the exporter, as (name, type, help)
+metrics_help = [
+    ("snaplock_noncompliant_snapshots", "gauge", "Number of snapshots with a SnapLock expiry time shorter than their label policy"),
+    ("snaplock_expiry_gap_seconds", "gauge", "Smallest difference between the SnapLock expiry time of a snapshot and the one required by its label policy, negative when not compliant"),
+    ("snaplock_scan_success", "gauge", "Whether the last scan of the system succeeded"),
+    ("snaplock_last_scan_duration_seconds", "gauge", "Duration of the last scan of the system"),
+    ("snaplock_last_scan_timestamp_seconds", "gauge", "Time the last scan of the system finished"),
+    ("snaplock_api_calls_total", "counter", "Number of API calls made to the system"),
+    ("snaplock_api_errors_total", "counter", "Number of API calls to the system that failed"),
+]
+
+# Escape a label value for the text exposition format
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+# Prometheus/OpenMetrics text exposition of SnapLock compliance
+#
+# Samples are replaced system by system with set_system() after each scan,
+# and rendered on every GET /metrics.
+class MetricsExporter(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.systems = {}
+
+    # Replace the samples of a system
+    # samples is a list of (name, {label: value}, value)
+    def set_system(self, system, samples):
+        with self.lock:
+            self.systems[system] = samples
+
+    def render(self):
+        with self.lock:
+            systems = dict(self.systems)
+        lines = []
+        for name, kind, text in metrics_help:
+            lines.append("# HELP %s %s" % (name, text))
+            lines.append("# TYPE %s %s" % (name, kind))
+            for system in sorted(systems):
+                for sample, labels, value in systems[system]:
+                    if sample != name:
+                        continue
+                    labels = ",".join('%s="%s"' % (k, _escape(v)) for k, v in labels.items())
+                    lines.append("%s{%s} %s" % (name, labels, repr(float(value))))
+        return "\n".join(lines) + "\n"
+
+    # Serve metrics on http://address:port/metrics in a background thread
+    def serve(self, address, port):
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                body = exporter.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logging.debug("Exporter : " + format, *args)
+
+        server = ThreadingHTTPServer((address, port), Handler)
+        server.daemon_threads = True
+        thread = threading.Thread(target=server.serve_forever, name="exporter")
+        thread.daemon = True
+        thread.start()
+        return server
@@ -0,0 +1,475 @@
+import collections
+import concurrent.futures
+import json
+import logging
+import random
+import threading
+import time
+
+import requests
+
+from ontap_snaplock import _protect, eprint, stats
+from ontap_snaplock.apply import apply_changes, revalidate_changes
+from ontap_snaplock.client import OntapClient
+from ontap_snaplock.discovery import Discovery
+from ontap_snaplock.evaluation import Evaluator, parse_time, format_time
+from ontap_snaplock.shard import owns, parse_shard
+
+# Check and extension of the SnapLock expiry time of snapshots on ONTAP
+# systems, according to the policy of their snapmirror label
+#
+# options are the options of ontap-extend-snaplock-expiry.py, as returned by
+# ontap_snaplock.cli.extend_options(). state is an optional StateIndex, and
+# call_stats an optional CallStats collecting timings of API calls.
+#
+# An Extender can be used for several runs, ie. :
+#
+#   extender = Extender(config, cli.extend_options(check=True))
+#   with extender.connect(system) as client:
+#       compliance = extender.process_client(client, extender.new_run())
+class Extender(object):
+
+    def __init__(self, config, options, state=None, call_stats=None):
+        self.config = config
+        self.options = options
+        self.state = state
+        self.call_stats = call_stats or stats.CallStats()
+        self.labels = list(config['labels-policies'].keys())
+        self.discovery = Discovery(self.labels, options.max_records, options.check, self.get_watermark)
+
+        # With --shard-volumes, every shard processes all systems but only
+        # the volumes it owns
+        self.volume_shard = None
+        if options.shard and options.shard_volumes:
+            self.volume_shard = parse_shard(options.shard)
+
+        # Planned changes of each system, kept with options.plan
+        self.plans = {}
+
+    # Returns a new OntapClient for a system, to be closed after use
+    def connect(self, system):
+        return OntapClient(system, verify=not self.options.ignore_ssl, timeout=self.options.timeout, retries=self.options.retries,
+                           pool_size=self.options.pool_size, call_stats=self.call_stats)
+
+    # Returns the watermark from which snapshots of a label need to be
+    # evaluated in a volume, or None to evaluate all snapshots
+    def get_watermark(self, client, volume_uuid, label):
+        if self.state is None or self.options.full:
+            return None
+        return self.state.watermark(client.ip, volume_uuid, label, self.config['labels-policies'][label])
+
+    # Returns the results of a new run on a system
+    # - evaluator : Evaluator of the snapshots of the run
+    # - changes : changes to apply
+    # - evaluations : evaluations of snapshot lists, to update the state index
+    # - volumes : names of the snaplock volumes, by uuid
+    def new_run(self):
+        return {"evaluator": Evaluator(self.config['labels-policies'], self.options.max_expiry), "changes": [], "evaluations": [], "volumes": collections.OrderedDict()}
+
+    # Check all snapshots with a given label in a volume
+    # Returns the compliance of the volume for that label
+    def process_snapshots(self, client, volume_uuid, label, stop, run):
+        # In check mode, snapshots are evaluated page by page as they are
+        # listed, so the pages following the first snapshot not compliant are
+        # never retrieved
+        if self.options.check:
+            listing = {"status_code": 200}
+            return self.evaluate_snapshots(client, volume_uuid, self.discovery.iter_snapshot_pages(client, volume_uuid, label, listing), stop, run, listing)
+
+        snapshots = self.discovery.list_snapshots(client, volume_uuid, label)
+        if snapshots is None:
+            eprint("Failed to get snapshots for volume %s on %s" % (volume_uuid,client.ip))
+            return "error"
+
+        return self.evaluate_snapshots(client, volume_uuid, [snapshots], stop, run)
+
+    # Check pages of snapshots of a volume and plan the extension of their
+    # expiry time in run["changes"]
+    # If snapshots are listed while they are evaluated, listing is the listing
+    # status given to Discovery.iter_snapshot_pages
+    # Returns the compliance of the snapshots
+    def evaluate_snapshots(self, client, volume_uuid, pages, stop, run, listing=None):
+        compliance = "compliant"
+        evaluator = run["evaluator"]
+        check = self.options.check
+
+        # Watermarks of the labels, and for each label, the creation time of
+        # the snapshots evaluated and whether they are compliant (True/False,
+        # or the planned change until it is applied), to update the state
+        # index
+        watermarks = {}
+        for label in self.labels:
+            watermark = self.get_watermark(client, volume_uuid, label)
+            if watermark:
+                watermarks[label] = parse_time(watermark)
+        # The number of snapshots not compliant and the smallest difference
+        # between current and required expiry time are kept for --exporter
+        evaluation = {"volume_uuid": volume_uuid, "incomplete": False, "labels": {}, "noncompliant": 0, "gap": None}
+        def track(label, create_time, resolved):
+            evaluation["labels"].setdefault(label, []).append((create_time, resolved))
+        run["evaluations"].append(evaluation)
+
+        # Check all snapshots in the volume, a page at a time
+        for snapshots in pages:
+            # Another volume already decided compliance for this system
+            if stop.is_set():
+                evaluation["incomplete"] = True
+                break
+
+            logging.debug("Snapshots : %s", snapshots)
+
+            snapshots, complete = self.discovery.get_snapshot_details(client, volume_uuid, snapshots)
+            if not complete:
+                compliance = "error"
+                evaluation["incomplete"] = True
+                if check:
+                    break
+
+            for snapshot, create_time, expiry_time, gap in evaluator.evaluate(snapshots, watermarks):
+                label = snapshot['snapmirror_label']
+                logging.debug("Snapshot %s : expiry time %s, %s required by label '%s'" % (snapshot.get('name',snapshot['uuid']),snapshot['snaplock_expiry_time'],format_time(expiry_time),label))
+
+                if evaluation["gap"] is None or gap < evaluation["gap"]:
+                    evaluation["gap"] = gap
+                if gap >= 0:
+                    track(label, snapshot['create_time'], True)
+                    continue
+
+                evaluation["noncompliant"] += 1
+                if check:
+                    compliance="non-compliant"
+                    evaluation["incomplete"] = True
+                    track(label, snapshot['create_time'], False)
+                    break
+                # The exporter only reports, it doesn't plan changes
+                if self.options.exporter:
+                    compliance="non-compliant"
+                    track(label, snapshot['create_time'], False)
+                    continue
+
+                # Verify we are not locking for a date in the future bigger than max_expiry
+                if evaluator.beyond_max_expiry(expiry_time):
+                    logging.warning("Would set a date beyond max_expiry, ignoring")
+                    track(label, snapshot['create_time'], False)
+                    continue
+
+                # Plan the extension of Snaplock expiry time on snapshot, in
+                # the time zone of the snapshot creation time
+                change = {
+                    'vserver':snapshot['svm']['name'],
+                    'volume':snapshot['volume']['name'],
+                    'volume_uuid':volume_uuid,
+                    'snapshot':snapshot['name'],
+                    'snapshot_uuid':snapshot['uuid'],
+                    'label':label,
+                    'create_time':snapshot['create_time'],
+                    'snaplock_expiry_time':snapshot['snaplock_expiry_time'],
+                    'expiry-time':format_time(expiry_time),
+                }
+                run["changes"].append(change)
+                track(label, snapshot['create_time'], change)
+
+            if compliance == "non-compliant" and check:
+                break
+
+        if listing is not None and listing["status_code"] != 200:
+            compliance = "error"
+            evaluation["incomplete"] = True
+
+        return compliance
+
+    # Update the state index from the evaluation of a volume, once changes are
+    # applied. The watermark of each label moves to the oldest snapshot still
+    # not compliant, or to the latest snapshot if they all are.
+    def update_state(self, client, evaluation):
+        if self.state is None or evaluation["incomplete"]:
+            return
+        for label, snapshots in evaluation["labels"].items():
+            latest = None
+            unresolved = None
+            for create_time, resolved in snapshots:
+                if isinstance(resolved, dict):
+                    resolved = resolved.get('status') == "applied"
+                create_time_obj = parse_time(create_time)
+                if latest is None or latest[0] < create_time_obj:
+                    latest = (create_time_obj, create_time)
+                if not resolved and (unresolved is None or create_time_obj < unresolved[0]):
+                    unresolved = (create_time_obj, create_time)
+            watermark = unresolved and unresolved[1] or latest[1]
+            self.state.update(client.ip, evaluation["volume_uuid"], label, self.config['labels-policies'][label], watermark)
+
+    # Record in the state index the volumes of a system still not compliant
+    # after a run, so they are checked first by the next --check
+    # Volumes that were not completely evaluated keep their previous status.
+    def update_noncompliant(self, client, run):
+        if self.state is None:
+            return
+        found = set()
+        evaluated = set()
+        incomplete = set()
+        for evaluation in run["evaluations"]:
+            volume_uuid = evaluation["volume_uuid"]
+            evaluated.add(volume_uuid)
+            if evaluation["incomplete"]:
+                incomplete.add(volume_uuid)
+            for snapshots in evaluation["labels"].values():
+                for create_time, resolved in snapshots:
+                    if isinstance(resolved, dict):
+                        resolved = resolved.get('status') == "applied"
+                    if not resolved:
+                        found.add(volume_uuid)
+        cleared = evaluated - incomplete - found
+        self.state.set_noncompliant(client.ip, (set(self.state.noncompliant(client.ip)) - cleared) | found)
+
+    # Apply planned changes on a system, see apply_changes
+    def apply_changes(self, client, changes):
+        apply_changes(client, changes, simulate=self.options.simulate, batch_query=self.options.batch_query,
+                      batch_size=self.options.batch_size, workers=self.options.apply_workers)
+
+    # Apply the changes planned for a system
+    def process_plan(self, system, changes):
+        logging.debug("Applying plan on system '%s'" % json.dumps(_protect(system)))
+
+        with self.connect(system) as client:
+            try:
+                evaluator = Evaluator(self.config['labels-policies'], self.options.max_expiry)
+                self.apply_changes(client, revalidate_changes(client, changes, evaluator, self.options.max_records))
+            except requests.exceptions.RequestException as e:
+                eprint("Unable to communicate with %s" % client.ip)
+                eprint(e)
+            logging.debug("Connection statistics for %s : %s", system["ip"], client.stats())
+            self.call_stats.record_connections(system["ip"], client.stats())
+
+    # Apply a plan, a dictionary of changes by system ip, without listing
+    # snapshots, at most options.workers systems at the same time
+    # With volume sharding, only the changes of the volumes owned by the shard
+    # are applied
+    def apply_plan(self, plan):
+        if self.volume_shard is not None:
+            plan = collections.OrderedDict((ip, [change for change in changes if owns(self.volume_shard, ip, change['volume_uuid'])]) for ip, changes in plan.items())
+        systems = dict((system["ip"],system) for system in self.config["systems"])
+        for ip in plan:
+            if ip not in systems:
+                eprint("System %s of the plan is not in the configuration file, skipping" % ip)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.options.workers) as executor:
+            for result in [executor.submit(self.process_plan, systems[ip], changes) for ip, changes in plan.items() if ip in systems]:
+                result.result()
+
+    # Check all configured labels in a volume
+    # snapshots is the list of snapshots of the volume if they were already
+    # retrieved by a cluster-wide query
+    # Returns the compliance of the volume
+    def process_volume(self, client, volume, stop, run, snapshots=None):
+        logging.debug("Checking volume : %s", volume)
+        volume_uuid = volume['uuid']
+
+        if snapshots is not None:
+            return self.evaluate_snapshots(client, volume_uuid, [snapshots], stop, run)
+
+        compliance = "compliant"
+        for label in self.labels:
+            if stop.is_set():
+                break
+            result = self.process_snapshots(client, volume_uuid, label, stop, run)
+            if result != "compliant" and compliance == "compliant":
+                compliance = result
+                if self.options.check:
+                    break
+
+        return compliance
+
+    # Check a system and all its snaplock volumes
+    # Unexpected failures only make this system "error", so other systems
+    # are still reported.
+    # Returns the compliance of the system
+    def process_system(self, system):
+        logging.debug("Checking system '%s'" % json.dumps(_protect(system)))
+
+        with self.connect(system) as client:
+            try:
+                compliance = self.process_client(client, self.new_run())
+            except Exception as e:
+                eprint("Check of %s failed" % client.ip)
+                eprint(e)
+                compliance = "error"
+            logging.debug("Connection statistics for %s : %s", system["ip"], client.stats())
+            self.call_stats.record_connections(system["ip"], client.stats())
+        return compliance
+
+    # Check all snaplock volumes of a system using an already configured
+    # client, collecting results in run (see new_run)
+    # Returns the compliance of the system
+    def process_client(self, client, run):
+        options = self.options
+        try:
+            r = self.discovery.list_volumes(client)
+        except requests.exceptions.SSLError as e:
+            # Handle SSL exception
+            if not options.check:
+                eprint("Certificate verification failed for %s. Use -k or add appropriate CA to system configuration" % client.ip)
+                eprint(e)
+            return "error"
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            # Handle other connection errors
+            if not options.check:
+                eprint("Unable to connect to %s" % client.ip)
+                eprint(e)
+            return "error"
+
+        # Bail if for some reason we don't get code 200
+        if r.status_code != 200:
+            if not options.check:
+                eprint("Failed to connect to %s (Code %i : %s)" % (client.ip,r.status_code,r.reason))
+            return "error"
+
+        try:
+            volumes = r.json()
+            if not isinstance(volumes.get('records'), list):
+                raise ValueError("no volume records")
+        except (ValueError, AttributeError) as e:
+            if not options.check:
+                eprint("Invalid volume list from %s (%s)" % (client.ip,e))
+            return "error"
+        logging.debug("Volumes : %s", volumes)
+        if self.volume_shard is not None:
+            volumes['records'] = [volume for volume in volumes['records'] if owns(self.volume_shard, client.ip, volume['uuid'])]
+        for volume in volumes['records']:
+            run["volumes"][volume['uuid']] = volume.get('name', volume['uuid'])
+
+        # In check mode, volumes that were not compliant on the last run are
+        # checked first
+        if options.check and self.state is not None:
+            noncompliant = set(self.state.noncompliant(client.ip))
+            volumes['records'].sort(key=lambda volume: volume['uuid'] not in noncompliant)
+
+        volume_snapshots = None
+        if options.cluster_query:
+            try:
+                volume_snapshots = self.discovery.list_cluster_snapshots(client, [volume['uuid'] for volume in volumes['records']])
+            except requests.exceptions.RequestException as e:
+                if not options.check:
+                    eprint("Unable to communicate with %s" % client.ip)
+                    eprint(e)
+                return "error"
+
+        # Check all volumes in the systems for snaplock snapshots, with at
+        # most options.cluster_concurrency volumes processed at the same time.
+        # In check mode, the first volume that is not compliant stops the
+        # others. Changes to apply are collected in run["changes"].
+        compliance = "compliant"
+        stop = threading.Event()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=options.cluster_concurrency) as executor:
+            futures = [executor.submit(self.process_volume, client, volume, stop, run, None if volume_snapshots is None else volume_snapshots[volume['uuid']]) for volume in volumes['records']]
+            try:
+                for future in concurrent.futures.as_completed(futures):
+                    if future.cancelled():
+                        continue
+                    result = future.result()
+                    if result != "compliant" and compliance == "compliant":
+                        compliance = result
+                        if options.check:
+                            stop.set()
+                            for f in futures:
+                                f.cancel()
+            except requests.exceptions.RequestException as e:
+                stop.set()
+                for f in futures:
+                    f.cancel()
+                if not options.check:
+                    eprint("Unable to communicate with %s" % client.ip)
+                    eprint(e)
+                return "error"
+
+        self.apply_changes(client, run["changes"])
+
+        if options.plan:
+            self.plans[client.ip] = run["changes"]
+
+        for evaluation in run["evaluations"]:
+            self.update_state(client, evaluation)
+        self.update_noncompliant(client, run)
+
+        return compliance
+
+    # Check systems, at most options.workers at the same time
+    # Returns the compliance of each system, in the order of systems
+    def run(self, systems):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.options.workers) as executor:
+            return list(executor.map(self.process_system, systems))
+
+    # Write the changes planned for systems to a file, one JSON object per
+    # line, in the order of systems
+    def write_plan(self, path, systems):
+        with open(path,'w') as planfile:
+            for system in systems:
+                for change in self.plans.get(system["ip"],[]):
+                    record = {"system":system["ip"]}
+                    record.update(change)
+                    planfile.write(json.dumps(record) + "\n")
+
+    # Returns the metric samples of a scan of a system, for MetricsExporter
+    def scan_samples(self, client, run, compliance, duration):
+        volumes = collections.OrderedDict((volume_uuid, {"noncompliant": 0, "gap": None}) for volume_uuid in run["volumes"])
+        for evaluation in run["evaluations"]:
+            volume = volumes.setdefault(evaluation["volume_uuid"], {"noncompliant": 0, "gap": None})
+            volume["noncompliant"] += evaluation["noncompliant"]
+            if evaluation["gap"] is not None and (volume["gap"] is None or evaluation["gap"] < volume["gap"]):
+                volume["gap"] = evaluation["gap"]
+
+        samples = []
+        for volume_uuid, volume in volumes.items():
+            labels = {"system": client.ip, "volume": run["volumes"].get(volume_uuid, volume_uuid), "volume_uuid": volume_uuid}
+            samples.append(("snaplock_noncompliant_snapshots", labels, volume["noncompliant"]))
+            if volume["gap"] is not None:
+                samples.append(("snaplock_expiry_gap_seconds", labels, volume["gap"]))
+
+        samples.append(("snaplock_scan_success", {"system": client.ip}, compliance != "error" and 1 or 0))
+        samples.append(("snaplock_last_scan_duration_seconds", {"system": client.ip}, duration))
+        samples.append(("snaplock_last_scan_timestamp_seconds", {"system": client.ip}, time.time()))
+
+        for category, calls in self.call_stats.summary().get(client.ip, {}).get("calls", {}).items():
+            samples.append(("snaplock_api_calls_total", {"system": client.ip, "call": category}, calls["count"]))
+            samples.append(("snaplock_api_errors_total", {"system": client.ip, "call": category}, calls["errors"]))
+        return samples
+
+    # Scan a system every options.interval seconds, plus a random jitter, and
+    # publish the results to the exporter
+    # The client is kept open between scans so connections are reused. At
+    # most options.workers systems are scanned at the same time.
+    def export_system(self, system, exporter, scans):
+        logging.debug("Exporting system '%s'" % json.dumps(_protect(system)))
+
+        with self.connect(system) as client:
+            # Spread the first scans of all systems
+            time.sleep(random.uniform(0, self.options.jitter))
+            while True:
+                with scans:
+                    start = time.time()
+                    run = self.new_run()
+                    try:
+                        compliance = self.process_client(client, run)
+                    except Exception as e:
+                        eprint("Scan of %s failed" % client.ip)
+                        eprint(e)
+                        compliance = "error"
+                    duration = time.time() - start
+                logging.debug("Scanned %s in %.1fs : %s", client.ip, duration, compliance)
+                exporter.set_system(client.ip, self.scan_samples(client, run, compliance, duration))
+                time.sleep(self.options.interval + random.uniform(0, self.options.jitter))
+
+    # Scan systems in background threads and serve the results as Prometheus
+    # metrics on http://address:port/metrics
+    # Returns the HTTP server
+    def export(self, systems, address, port):
+        from ontap_snaplock.exporter import MetricsExporter
+
+        exporter = MetricsExporter()
+        server = exporter.serve(address, port)
+
+        scans = threading.BoundedSemaphore(self.options.workers)
+        for system in systems:
+            thread = threading.Thread(target=self.export_system, args=(system, exporter, scans), name="export-%s" % system["ip"])
+            thread.daemon = True
+            thread.start()
+        return server
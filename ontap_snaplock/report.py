@@ -0,0 +1,46 @@
+import csv
+import json
+
+# Columns of the snapshot capacity report, one row per system, vserver,
+# volume and label
+columns = ("System","Vserver","Volume","Label","Count","Size")
+
+# Formats of the report
+formats = ("tsv", "csv", "jsonl")
+
+# Writer of the snapshot capacity report
+#
+# - tsv : tab separated values, with a header before the rows of each system
+# - csv : comma separated values, with a single header
+# - jsonl : one JSON object per row, with the columns in lower case
+#
+# With flush, every row is flushed as soon as it is written so downstream
+# tools can consume the report while it is produced.
+class ReportWriter(object):
+
+    def __init__(self, output, format="tsv", flush=False):
+        self.output = output
+        self.format = format
+        self.flush = flush
+        self.headers = 0
+        if format == "csv":
+            self.csv = csv.writer(output, lineterminator="\n")
+
+    # Write the header of a system, if the format has one
+    def header(self):
+        if self.format == "tsv":
+            self.output.write("\t".join(columns) + "\n")
+        elif self.format == "csv" and self.headers == 0:
+            self.csv.writerow(columns)
+        self.headers += 1
+
+    # Write a row, as (system, vserver, volume, label, count, size)
+    def row(self, row):
+        if self.format == "tsv":
+            self.output.write("{0}\t{1}\t{2}\t{3}\t{4}\t{5}\n".format(*row))
+        elif self.format == "csv":
+            self.csv.writerow(row)
+        else:
+            self.output.write(json.dumps(dict(zip([column.lower() for column in columns], row))) + "\n")
+        if self.flush:
+            self.output.flush()
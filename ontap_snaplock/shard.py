@@ -0,0 +1,106 @@
+import hashlib
+import json
+import threading
+
+from ontap_snaplock import eprint
+
+# Partitioning of a run across several hosts or processes
+#
+# A run is split in count shards, numbered from 1. Each system, or with
+# volume sharding each volume of each system, is owned by a single shard,
+# chosen by rendezvous hashing of its key (the system ip, or the system ip and
+# volume uuid) : the shard with the highest hash of key and shard number wins.
+# Ownership only depends on the key and the number of shards, so every shard
+# agrees on it without coordination, and adding a shard only moves the keys
+# that the new shard wins.
+#
+# Each shard writes its results as a partial file, one JSON object per line,
+# starting with a header :
+#
+#   {"type": "shard", "script": "extend", "shard": 1, "count": 4}
+#
+# followed by records of the script (compliance of systems, rows of the delta
+# report) and the raw statistics of API calls. Partial files of all the shards
+# are combined by the --merge option of the script into the report of a single
+# run.
+
+# Parse a shard like 2/4
+# Returns (shard, count)
+def parse_shard(value):
+    try:
+        shard, count = [int(n) for n in value.split("/")]
+    except ValueError:
+        raise ValueError("Invalid shard %s, expected SHARD/COUNT (ie. 1/4)" % value)
+    if count < 1 or shard < 1 or shard > count:
+        raise ValueError("Invalid shard %s, SHARD must be between 1 and COUNT" % value)
+    return shard, count
+
+# Returns the shard, from 1 to count, that owns a key
+def owner(key, count):
+    def weight(shard):
+        return hashlib.md5(("%s/%i" % (key, shard)).encode("utf-8")).hexdigest()
+    return max(range(1, count + 1), key=weight)
+
+# Returns True if a shard (as returned by parse_shard) owns a key, or if shard
+# is None
+def owns(shard, *key):
+    if shard is None:
+        return True
+    return owner("/".join(key), shard[1]) == shard[0]
+
+# Partial results of a shard, written as they are produced
+# Records can be written from several threads.
+class PartialWriter(object):
+
+    def __init__(self, path, script, shard):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open(path, 'w')
+        shard = shard or (1, 1)
+        self.write("shard", script=script, shard=shard[0], count=shard[1])
+
+    # Write a record of a given type
+    def write(self, kind, **record):
+        record["type"] = kind
+        line = json.dumps(record) + "\n"
+        with self.lock:
+            self.file.write(line)
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+# Read the partial files of the shards of a run
+# Shards that are missing or given more than once are reported on stderr.
+# Returns the records of all the files, grouped by type, in the order of the
+# files
+def read_partials(paths, script):
+    records = {}
+    shards = {}
+    counts = set()
+    for path in paths:
+        with open(path, 'r') as partialfile:
+            header = None
+            for line in partialfile:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if header is None:
+                    if record.get("type") != "shard" or record.get("script") != script:
+                        raise ValueError("%s is not a partial result of %s" % (path, script))
+                    header = record
+                    shards.setdefault(record["shard"], []).append(path)
+                    counts.add(record["count"])
+                    continue
+                records.setdefault(record.pop("type"), []).append(record)
+
+    if len(counts) > 1:
+        eprint("Partial results were written with different shard counts (%s)" % ", ".join(str(count) for count in sorted(counts)))
+    for count in counts:
+        missing = [str(shard) for shard in range(1, count + 1) if shard not in shards]
+        if missing:
+            eprint("Partial results of shards %s of %i are missing" % (",".join(missing), count))
+    for shard, files in sorted(shards.items()):
+        if len(files) > 1:
+            eprint("Partial results of shard %i were given more than once (%s)" % (shard, ", ".join(files)))
+    return records
@@ -0,0 +1,76 @@
+import json
+import logging
+import os
+import threading
+
+# Local state index of SnapLock snapshots already confirmed compliant
+#
+# For every (system, volume, label), we keep a watermark : the creation time
+# from which snapshots still need to be evaluated. Every snapshot created
+# before the watermark was confirmed to have a SnapLock expiry time of at
+# least create_time + policy. As SnapLock expiry time can only be extended,
+# these snapshots will stay compliant as long as the policy for the label
+# doesn't change, so the watermark is only valid for the policy it was
+# recorded with.
+#
+# The index is stored as a JSON file :
+#
+# {
+#   "systems": {
+#     "cluster1": {
+#       "volumes": {
+#         volume_uuid: {
+#           label: { "policy": 86400, "watermark": "2024-01-01T00:00:00+02:00" }
+#         }
+#       },
+#       "noncompliant": [ volume_uuid ]
+#     }
+#   }
+# }
+class StateIndex(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        try:
+            with open(path, 'r') as statefile:
+                logging.debug("Opening state index %s" % path)
+                self.state = json.load(statefile)
+        except (IOError, OSError):
+            logging.debug("No state index found at %s, starting from scratch" % path)
+            self.state = {"systems": {}}
+
+    def _volume(self, system, volume_uuid):
+        volumes = self.state["systems"].setdefault(system, {}).setdefault("volumes", {})
+        return volumes.setdefault(volume_uuid, {})
+
+    # Returns the watermark for a label in a volume, or None if we have no
+    # watermark recorded for this policy
+    def watermark(self, system, volume_uuid, label, policy):
+        with self.lock:
+            entry = self.state["systems"].get(system, {}).get("volumes", {}).get(volume_uuid, {}).get(label)
+        if entry is None or entry.get("policy") != policy:
+            return None
+        return entry.get("watermark")
+
+    def update(self, system, volume_uuid, label, policy, watermark):
+        with self.lock:
+            self._volume(system, volume_uuid)[label] = {"policy": policy, "watermark": watermark}
+
+    # Returns the uuids of the volumes of a system that were not compliant
+    # after the last run
+    def noncompliant(self, system):
+        with self.lock:
+            return list(self.state["systems"].get(system, {}).get("noncompliant", []))
+
+    def set_noncompliant(self, system, volume_uuids):
+        with self.lock:
+            self.state["systems"].setdefault(system, {})["noncompliant"] = sorted(volume_uuids)
+
+    # Write the index to disk, replacing the previous one atomically
+    def save(self):
+        with self.lock:
+            tmp = self.path + ".tmp"
+            with open(tmp, 'w') as statefile:
+                json.dump(self.state, statefile)
+            os.replace(tmp, self.path)
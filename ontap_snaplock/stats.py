@@ -0,0 +1,144 @@
+import collections
+import json
+import math
+import threading
+
+# API call categories
+VOLUME_LIST = "volume-list"
+SNAPSHOT_LIST = "snapshot-list"
+SNAPSHOT_DETAIL = "snapshot-detail"
+MODIFY_EXPIRY = "modify-expiry"
+SNAPSHOT_GET_ITER = "snapshot-get-iter"
+SNAPSHOT_DELTA_INFO = "snapshot-delta-info"
+OTHER = "other"
+
+# Returns the value at percentile p (0-100) of a sorted list, using the
+# nearest-rank method
+def percentile(values, p):
+    if not values:
+        return 0
+    rank = int(math.ceil(p * len(values) / 100.0)) - 1
+    return values[min(max(rank, 0), len(values) - 1)]
+
+# Timings of API calls, aggregated per system and call category
+#
+# If max_samples is set, percentiles are computed on the last max_samples
+# calls of each category only, so a long-running process doesn't grow
+# forever. Counts and totals always cover all calls.
+class CallStats(object):
+
+    def __init__(self, max_samples=None):
+        self.max_samples = max_samples
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.connections = {}
+
+    # Record an API call that took elapsed seconds and transferred size bytes
+    def record(self, system, category, elapsed, size=0, error=False):
+        with self.lock:
+            calls = self.calls.setdefault(system, {}).get(category)
+            if calls is None:
+                calls = {"latencies": collections.deque(maxlen=self.max_samples), "count": 0, "total": 0, "bytes": 0, "errors": 0}
+                self.calls[system][category] = calls
+            calls["latencies"].append(elapsed)
+            calls["count"] += 1
+            calls["total"] += elapsed
+            calls["bytes"] += size
+            if error:
+                calls["errors"] += 1
+
+    # Add size bytes to a call already recorded, ie. the body of a streamed
+    # response once it is read
+    def record_bytes(self, system, category, size):
+        with self.lock:
+            calls = self.calls.get(system, {}).get(category)
+            if calls is not None:
+                calls["bytes"] += size
+
+    # Record connection reuse statistics of a system, from OntapClient.stats()
+    def record_connections(self, system, stats):
+        with self.lock:
+            self.connections[system] = stats
+
+    # Returns the raw statistics as a dictionary that can be serialized to
+    # JSON and combined with load(), ie. from the shards of a run
+    def dump(self):
+        with self.lock:
+            calls = {}
+            for system, categories in self.calls.items():
+                calls[system] = {}
+                for category, c in categories.items():
+                    calls[system][category] = {"latencies": list(c["latencies"]), "count": c["count"], "total": c["total"], "bytes": c["bytes"], "errors": c["errors"]}
+            return {"calls": calls, "connections": dict((system, dict(stats)) for system, stats in self.connections.items())}
+
+    # Add statistics returned by dump()
+    # Connection statistics of a system recorded more than once are summed
+    def load(self, data):
+        with self.lock:
+            for system, categories in data.get("calls", {}).items():
+                for category, c in categories.items():
+                    calls = self.calls.setdefault(system, {}).get(category)
+                    if calls is None:
+                        calls = {"latencies": collections.deque(maxlen=self.max_samples), "count": 0, "total": 0, "bytes": 0, "errors": 0}
+                        self.calls[system][category] = calls
+                    calls["latencies"].extend(c["latencies"])
+                    for key in ("count", "total", "bytes", "errors"):
+                        calls[key] += c[key]
+            for system, stats in data.get("connections", {}).items():
+                connections = self.connections.setdefault(system, {})
+                for key, value in stats.items():
+                    connections[key] = connections.get(key, 0) + value
+
+    # Returns the statistics as a dictionary
+    # {
+    #   system: {
+    #     "calls": {
+    #       category: { "count", "errors", "bytes", "total", "p50", "p95", "max" }
+    #     },
+    #     "connections": { "requests", "attempts", "connections", "reused" }
+    #   }
+    # }
+    # Durations are in seconds
+    def summary(self):
+        with self.lock:
+            summary = {}
+            for system in list(self.calls) + [s for s in self.connections if s not in self.calls]:
+                summary[system] = {"calls": {}}
+                for category, calls in self.calls.get(system, {}).items():
+                    latencies = sorted(calls["latencies"])
+                    summary[system]["calls"][category] = {
+                        "count": calls["count"],
+                        "errors": calls["errors"],
+                        "bytes": calls["bytes"],
+                        "total": calls["total"],
+                        "p50": percentile(latencies, 50),
+                        "p95": percentile(latencies, 95),
+                        "max": latencies and latencies[-1] or 0,
+                    }
+                if system in self.connections:
+                    summary[system]["connections"] = self.connections[system]
+            return summary
+
+    # Returns the statistics as a tab separated table, slowest systems and
+    # calls first
+    def report(self):
+        lines = ["\t".join(["System", "Call", "Count", "Errors", "p50(ms)", "p95(ms)", "Max(ms)", "Total(s)", "Bytes"])]
+        summary = self.summary()
+        def total(system):
+            return sum(c["total"] for c in summary[system]["calls"].values())
+        for system in sorted(summary, key=total, reverse=True):
+            calls = summary[system]["calls"]
+            for category in sorted(calls, key=lambda c: calls[c]["total"], reverse=True):
+                c = calls[category]
+                lines.append("%s\t%s\t%i\t%i\t%.1f\t%.1f\t%.1f\t%.3f\t%i" % (system, category, c["count"], c["errors"],
+                             c["p50"] * 1000, c["p95"] * 1000, c["max"] * 1000, c["total"], c["bytes"]))
+        return "\n".join(lines)
+
+    # Print the report to a stream, or write the summary as JSON if path is
+    # not "-"
+    def write(self, path, stream):
+        if path == "-":
+            stream.write(self.report() + "\n")
+        else:
+            with open(path, 'w') as statsfile:
+                json.dump(self.summary(), statsfile, indent=2)
@@ -0,0 +1,98 @@
+import datetime
+import unittest
+
+from ontap_snaplock.evaluation import Evaluator, format_time, parse_time
+
+utc = datetime.timezone.utc
+cest = datetime.timezone(datetime.timedelta(hours=2))
+
+# Returns a snapshot record as listed by the REST API
+def snapshot(create_time, expiry_time, label="daily"):
+    return {"name": "s", "create_time": create_time, "snaplock_expiry_time": expiry_time, "snapmirror_label": label}
+
+# Checks of the time zone aware evaluation of SnapLock expiry times
+# Run with python -m unittest discover tests
+class ParseTimeTest(unittest.TestCase):
+
+    def test_z_and_offsets(self):
+        self.assertEqual(parse_time("2024-01-01T00:00:00Z"), datetime.datetime(2024, 1, 1, tzinfo=utc))
+        self.assertEqual(parse_time("2024-01-01T02:00:00+02:00"), parse_time("2024-01-01T00:00:00Z"))
+        self.assertEqual(parse_time("2023-12-31T19:00:00-05:00"), parse_time("2024-01-01T00:00:00Z"))
+
+    # Expiry times of plans written by older releases have no time zone
+    def test_naive_with_tzinfo(self):
+        parsed = parse_time("2024-01-01T02:00:00", cest)
+        self.assertEqual(parsed.tzinfo, cest)
+        self.assertEqual(parsed, parse_time("2024-01-01T00:00:00Z"))
+        self.assertIsNone(parse_time("2024-01-01T02:00:00").tzinfo)
+
+    # A date with a time zone keeps it, whatever tzinfo is given
+    def test_aware_ignores_tzinfo(self):
+        self.assertEqual(parse_time("2024-01-01T00:00:00Z", cest).tzinfo, utc)
+
+    def test_format_keeps_offset(self):
+        self.assertEqual(format_time(parse_time("2024-01-01T02:00:00.500+02:00")), "2024-01-01T02:00:00+02:00")
+
+class EvaluatorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.now = datetime.datetime(2024, 6, 1, tzinfo=utc)
+        self.evaluator = Evaluator({"daily": 86400, "hourly": 3600}, 30 * 86400, now=self.now)
+
+    # Creation and expiry times in different time zones are compared as
+    # instants
+    def test_mixed_offsets(self):
+        # Created at 00:00Z, expires one day later at 02:00+02:00 == 00:00Z
+        results = self.evaluator.evaluate([snapshot("2024-05-01T00:00:00Z", "2024-05-02T02:00:00+02:00")])
+        self.assertEqual(len(results), 1)
+        record, create_time, expiry_time, gap = results[0]
+        self.assertEqual(expiry_time, parse_time("2024-05-02T00:00:00Z"))
+        self.assertEqual(gap, 0)
+
+        # The same wall clock time in UTC is two hours later than in +02:00
+        gap = self.evaluator.evaluate([snapshot("2024-05-01T02:00:00+02:00", "2024-05-02T02:00:00Z")])[0][3]
+        self.assertEqual(gap, 7200)
+
+        # 23:00-01:00 is midnight UTC of the next day
+        gap = self.evaluator.evaluate([snapshot("2024-05-01T00:00:00Z", "2024-05-01T23:00:00-01:00")])[0][3]
+        self.assertEqual(gap, 0)
+
+        # Created at 02:00Z, so midnight UTC of the next day is two hours
+        # short
+        gap = self.evaluator.evaluate([snapshot("2024-05-01T00:00:00-02:00", "2024-05-02T00:00:00Z")])[0][3]
+        self.assertEqual(gap, -7200)
+
+    def test_skipped(self):
+        results = self.evaluator.evaluate([
+            snapshot("2024-05-01T00:00:00Z", "2024-05-02T00:00:00Z", label="weekly"),
+            snapshot("2024-05-01T00:00:00Z", None),
+            snapshot("2024-05-01T00:00:00Z", ""),
+            {"name": "s", "create_time": "2024-05-01T00:00:00Z", "snaplock_expiry_time": "2024-05-02T00:00:00Z"},
+        ])
+        self.assertEqual(results, [])
+
+    # Snapshots created before the watermark of their label are skipped,
+    # whatever the time zone of the watermark
+    def test_watermark(self):
+        snapshots = [
+            snapshot("2024-05-01T00:00:00Z", "2024-05-02T00:00:00Z"),
+            snapshot("2024-05-01T03:00:00+02:00", "2024-05-02T03:00:00+02:00"),
+            snapshot("2024-05-01T01:00:00Z", "2024-05-02T01:00:00Z"),
+            snapshot("2024-05-01T00:00:00Z", "2024-05-01T01:00:00Z", label="hourly"),
+        ]
+        watermarks = {"daily": parse_time("2024-05-01T03:00:00+02:00")}
+        results = self.evaluator.evaluate(snapshots, watermarks)
+        self.assertEqual([create_time for record, create_time, expiry_time, gap in results],
+                         [parse_time("2024-05-01T01:00:00Z"), parse_time("2024-05-01T01:00:00Z"), parse_time("2024-05-01T00:00:00Z")])
+        self.assertEqual(results[-1][0]["snapmirror_label"], "hourly")
+
+    def test_max_expiry(self):
+        cutoff = self.now + datetime.timedelta(days=30)
+        self.assertFalse(self.evaluator.beyond_max_expiry(cutoff))
+        self.assertTrue(self.evaluator.beyond_max_expiry(cutoff + datetime.timedelta(seconds=1)))
+        # Compared as instants, not wall clock times
+        self.assertFalse(self.evaluator.beyond_max_expiry(parse_time("2024-07-01T01:00:00+02:00")))
+        self.assertTrue(self.evaluator.beyond_max_expiry(parse_time("2024-07-01T01:00:00-02:00")))
+
+if __name__ == "__main__":
+    unittest.main()
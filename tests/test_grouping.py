@@ -0,0 +1,42 @@
+import unittest
+
+from ontap_snaplock.delta import VolumeGrouper
+
+# Checks of the grouping of listed snapshots by volume
+# Run with python -m unittest discover tests
+class VolumeGrouperTest(unittest.TestCase):
+
+    def test_empty(self):
+        self.assertIsNone(VolumeGrouper().finish())
+
+    # A volume is returned as soon as the records of the next one start, and
+    # the last one by finish
+    def test_volumes(self):
+        grouper = VolumeGrouper()
+        records = [
+            ("svm0", "vol0", "daily", 2, "d2", "u2"),
+            ("svm0", "vol0", "hourly", 1, "h1", "u1"),
+            ("svm0", "vol0", "daily", 1, "d1", "u3"),
+            ("svm0", "vol1", "daily", 5, "d5", "u4"),
+            ("svm1", "vol1", "daily", 6, "d6", "u5"),
+        ]
+        completed = [grouper.add(record) for record in records]
+        self.assertEqual(completed[:3], [None, None, None])
+        self.assertEqual(completed[3], ("svm0", "vol0", {"daily": [(2, "d2", "u2"), (1, "d1", "u3")], "hourly": [(1, "h1", "u1")]}))
+        # Volumes with the same name in another vserver are distinct
+        self.assertEqual(completed[4], ("svm0", "vol1", {"daily": [(5, "d5", "u4")]}))
+        self.assertEqual(grouper.finish(), ("svm1", "vol1", {"daily": [(6, "d6", "u5")]}))
+
+    # Snapshots of a volume that are not listed together are returned in
+    # several groups, with a warning
+    def test_split_volume(self):
+        grouper = VolumeGrouper()
+        grouper.add(("svm0", "vol0", "daily", 1, "a", "u1"))
+        grouper.add(("svm0", "vol1", "daily", 1, "b", "u2"))
+        with self.assertLogs(level="WARNING"):
+            completed = grouper.add(("svm0", "vol0", "daily", 2, "c", "u3"))
+        self.assertEqual(completed, ("svm0", "vol1", {"daily": [(1, "b", "u2")]}))
+        self.assertEqual(grouper.finish(), ("svm0", "vol0", {"daily": [(2, "c", "u3")]}))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from ontap_snaplock.shard import PartialWriter, owner, owns, parse_shard, read_partials
+
+keys = ["10.0.0.%i/svm%i/vol%i" % (i % 7, i % 3, i) for i in range(200)]
+
+# Checks of the partitioning of runs with --shard
+# Run with python -m unittest discover tests
+class ShardTest(unittest.TestCase):
+
+    def test_parse(self):
+        self.assertEqual(parse_shard("2/4"), (2, 4))
+        self.assertEqual(parse_shard("1/1"), (1, 1))
+        for value in ("0/4", "5/4", "1/0", "1", "a/b", "1/2/3"):
+            with self.assertRaises(ValueError):
+                parse_shard(value)
+
+    # Every key has a single owner, which is stable
+    def test_owner(self):
+        for count in (1, 2, 3, 8):
+            for key in keys:
+                shard = owner(key, count)
+                self.assertTrue(1 <= shard <= count)
+                self.assertEqual(owner(key, count), shard)
+                self.assertEqual([n for n in range(1, count + 1) if owns((n, count), key)], [shard])
+
+    # Keys are spread over all the shards
+    def test_spread(self):
+        counts = [0, 0, 0, 0]
+        for key in keys:
+            counts[owner(key, 4) - 1] += 1
+        for count in counts:
+            self.assertTrue(count > len(keys) / 8, counts)
+
+    # Adding a shard only moves the keys that the new shard wins
+    def test_rendezvous(self):
+        for key in keys:
+            before, after = owner(key, 3), owner(key, 4)
+            self.assertTrue(after == before or after == 4)
+
+    # owns joins its key parts with /, and everything is owned without shard
+    def test_owns(self):
+        self.assertTrue(owns(None, "10.0.0.1", "svm0", "vol0"))
+        shard = (owner("10.0.0.1/svm0/vol0", 3), 3)
+        self.assertTrue(owns(shard, "10.0.0.1", "svm0", "vol0"))
+
+class PartialTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="ontap-shard")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, shard, script="delta", records=()):
+        path = os.path.join(self.directory, name)
+        writer = PartialWriter(path, script, shard)
+        for record in records:
+            writer.write("row", **record)
+        writer.close()
+        return path
+
+    def test_read(self):
+        paths = [self.write("1.jsonl", (1, 2), records=[{"index": 0}]), self.write("2.jsonl", (2, 2), records=[{"index": 1}, {"index": 2}])]
+        self.assertEqual(read_partials(paths, "delta"), {"row": [{"index": 0}, {"index": 1}, {"index": 2}]})
+
+    def test_other_script(self):
+        path = self.write("1.jsonl", (1, 1), script="extend")
+        with self.assertRaises(ValueError):
+            read_partials([path], "delta")
+
+if __name__ == "__main__":
+    unittest.main()
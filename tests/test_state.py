@@ -0,0 +1,86 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from ontap_snaplock import cli
+from ontap_snaplock.extend import Extender
+from ontap_snaplock.state import StateIndex
+
+config = {"systems": [], "labels-policies": {"daily": 86400, "hourly": 3600}}
+
+# Stands for an OntapClient, only its ip is used
+class Client(object):
+    ip = "cluster1"
+
+# Checks of the watermarks recorded in the state index by --state
+# Run with python -m unittest discover tests
+class UpdateStateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="ontap-state")
+        self.path = os.path.join(self.directory, "state.json")
+        self.state = StateIndex(self.path)
+        self.extender = Extender(config, cli.extend_options(), state=self.state)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def update(self, labels, incomplete=False):
+        self.extender.update_state(Client(), {"volume_uuid": "v1", "labels": labels, "incomplete": incomplete})
+
+    def watermark(self, label="daily", policy=86400):
+        return self.state.watermark("cluster1", "v1", label, policy)
+
+    # With every snapshot compliant, the watermark moves to the latest one
+    def test_all_resolved(self):
+        self.update({"daily": [("2024-05-01T00:00:00Z", True), ("2024-05-03T00:00:00Z", True), ("2024-05-02T00:00:00Z", True)]})
+        self.assertEqual(self.watermark(), "2024-05-03T00:00:00Z")
+
+    # Otherwise it stays on the oldest snapshot still not compliant
+    def test_oldest_unresolved(self):
+        self.update({"daily": [("2024-05-01T00:00:00Z", True), ("2024-05-03T00:00:00Z", False), ("2024-05-02T00:00:00Z", False)]})
+        self.assertEqual(self.watermark(), "2024-05-02T00:00:00Z")
+
+    # Changes are resolved only once applied
+    def test_changes(self):
+        self.update({"daily": [("2024-05-01T00:00:00Z", {"status": "applied"}), ("2024-05-02T00:00:00Z", {"status": "failed"}),
+                               ("2024-05-03T00:00:00Z", {})]})
+        self.assertEqual(self.watermark(), "2024-05-02T00:00:00Z")
+
+    # Creation times are compared as instants, not as strings
+    def test_mixed_offsets(self):
+        self.update({"daily": [("2024-05-01T01:00:00+02:00", True), ("2024-05-01T00:30:00Z", True)]})
+        self.assertEqual(self.watermark(), "2024-05-01T00:30:00Z")
+        self.update({"daily": [("2024-05-01T01:00:00+02:00", False), ("2024-05-01T00:30:00Z", False)]})
+        self.assertEqual(self.watermark(), "2024-05-01T01:00:00+02:00")
+
+    def test_labels(self):
+        self.update({"daily": [("2024-05-01T00:00:00Z", True)], "hourly": [("2024-05-02T00:00:00Z", False)]})
+        self.assertEqual(self.watermark(), "2024-05-01T00:00:00Z")
+        self.assertEqual(self.watermark("hourly", 3600), "2024-05-02T00:00:00Z")
+
+    # Volumes that were not completely evaluated keep their watermark
+    def test_incomplete(self):
+        self.update({"daily": [("2024-05-01T00:00:00Z", True)]})
+        self.update({"daily": [("2024-05-03T00:00:00Z", True)]}, incomplete=True)
+        self.assertEqual(self.watermark(), "2024-05-01T00:00:00Z")
+
+    # A watermark is only valid for the policy it was recorded with
+    def test_policy_change(self):
+        self.update({"daily": [("2024-05-01T00:00:00Z", True)]})
+        self.assertIsNone(self.watermark(policy=2 * 86400))
+
+    def test_full(self):
+        self.update({"daily": [("2024-05-01T00:00:00Z", True)]})
+        self.assertEqual(self.extender.get_watermark(Client(), "v1", "daily"), "2024-05-01T00:00:00Z")
+        full = Extender(config, cli.extend_options(full=True), state=self.state)
+        self.assertIsNone(full.get_watermark(Client(), "v1", "daily"))
+
+    def test_save(self):
+        self.update({"daily": [("2024-05-01T00:00:00Z", True)]})
+        self.state.save()
+        self.assertEqual(StateIndex(self.path).watermark("cluster1", "v1", "daily", 86400), "2024-05-01T00:00:00Z")
+
+if __name__ == "__main__":
+    unittest.main()
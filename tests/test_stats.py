@@ -0,0 +1,33 @@
+import unittest
+
+from ontap_snaplock.stats import percentile
+
+# Checks of the nearest-rank percentile of --stats
+# Run with python -m unittest discover tests
+class PercentileTest(unittest.TestCase):
+
+    def test_empty(self):
+        self.assertEqual(percentile([], 50), 0)
+
+    def test_single(self):
+        for p in (0, 50, 95, 100):
+            self.assertEqual(percentile([7], p), 7)
+
+    # The rank is the ceiling of p * n / 100, also when it is a whole number
+    def test_whole_rank(self):
+        self.assertEqual(percentile([1, 2], 50), 1)
+        self.assertEqual(percentile(list(range(10)), 50), 4)
+        self.assertEqual(percentile(list(range(20)), 95), 18)
+        self.assertEqual(percentile(list(range(100)), 7), 6)
+
+    def test_fractional_rank(self):
+        self.assertEqual(percentile([1, 2, 3], 50), 2)
+        self.assertEqual(percentile(list(range(10)), 95), 9)
+
+    def test_bounds(self):
+        values = list(range(1, 11))
+        self.assertEqual(percentile(values, 0), 1)
+        self.assertEqual(percentile(values, 100), 10)
+
+if __name__ == "__main__":
+    unittest.main()